@@ -2,85 +2,58 @@
 This script is used to interact with the knowledge graph using OpenAI's GPT-4 model.
 """
 import json
+import time
 from openai import OpenAI
 from falkordb import FalkorDB
-from graph_schema import graph_schema
+from graph_schema import cached_graph_schema, schema_to_prompt
+from graph_alias import resolve_graph
+from replicas import read_graph, replica_clients
+from cypher_tool import run_cypher_query, run_cypher_queries, run_cypher_query_tool_description
+from intents import fast_path, fighter_names
+from aggregates import has_aggregates
+from chat_history import trim_history
 
-def run_cypher_query(graph, query):
-    try:
-        results = graph.ro_query(query).result_set
-    except:
-        results = {"error": "Query failed please try a different variation of this query"}
-    
-    if len(results) == 0:
-        results = {"error": "The query did not returned any data, please make sure you're using the right edge directions and you're following the correct graph schema"}
+# stream the model's answer to the terminal as it is generated
+# returns the answer and the time to its first token in ms
+def stream_answer(client, messages):
+    start = time.perf_counter()
+    time_to_first_token_ms = None
+    stream = client.chat.completions.create(
+        model="gpt-4-turbo-preview",
+        messages=messages,
+        stream=True,
+    )
 
-    return str(results)
+    content = []
+    print()
+    for chunk in stream:
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            continue
+        if time_to_first_token_ms is None:
+            time_to_first_token_ms = (time.perf_counter() - start) * 1000
+        content.append(chunk.choices[0].delta.content)
+        print(content[-1], end="", flush=True)
+    print("\n")
+    if time_to_first_token_ms is not None:
+        print(f"First token after {time_to_first_token_ms:.0f} ms\n")
 
-def schema_to_prompt(schema):
-    prompt = "The Knowledge graph contains nodes of the following types:\n"
-    
-    for node in schema['nodes']:
-        lbl = node
-        node = schema['nodes'][node]
-        if len(node['attributes']) > 0:
-            prompt += f"The {lbl} node type has the following set of attributes:\n"
-            for attr in node['attributes']:
-                t = node['attributes'][attr]['type']
-                prompt += f"The {attr} attribute is of type {t}\n"
-        else:
-            prompt += f"The {node} node type has no attributes:\n"
-    
-    prompt += "In addition the Knowledge graph contains edge of the following types:\n"
-    
-    for edge in schema['edges']:
-        rel = edge
-        edge = schema['edges'][edge]
-        if len(edge['attributes']) > 0:
-            prompt += f"The {rel} edge type has the following set of attributes:\n"
-            for attr in edge['attributes']:
-                t = edge['attributes'][attr]['type']
-                prompt += f"The {attr} attribute is of type {t}\n"
-        else:
-            prompt += f"The {rel} edge type has no attributes:\n"
-        
-        prompt += f"The {rel} edge connects the following entities:\n"
-        for conn in edge['connects']:
-            src  = conn[0]
-            dest = conn[1]
-            prompt += f"{src} is connected via {rel} to {dest}, (:{src})-[:{rel}]->(:{dest})\n"
-    
-    return prompt
+    return "".join(content), time_to_first_token_ms
 
 def main():
     # Connect to FalkorDB
     db = FalkorDB(host='localhost', port=6379)
-    g  = db.select_graph("UFC")
+    # read from the replicas, if any are configured, ingest keeps writing to the primary
+    g  = read_graph(db, resolve_graph(db, "UFC"), replica_clients())
     
-    schema = graph_schema(g)
+    schema = cached_graph_schema(g)
     schema_prompt = schema_to_prompt(schema)
+
+    # fighter names recognized by the fast path
+    names = fighter_names(g)
     
     client = OpenAI()
 
-    tools = [
-        {
-            "type": "function",
-            "function": {
-                "name": "run_cypher_query",
-                "description": "Runs a Cypher query against the knowledge graph",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "query": {
-                            "type": "string",
-                            "description": "Query to execute",
-                        },
-                    },
-                    "required": ["query"],
-                },
-            },
-        }
-    ]
+    tools = [run_cypher_query_tool_description]
 
     available_functions = {
         "run_cypher_query": run_cypher_query,
@@ -90,6 +63,10 @@ def main():
     SYSTEM_MESSAGE += schema_prompt
     SYSTEM_MESSAGE += "Query the knowledge graph to extract relavent information to help you anwser the users questions, base your answer only on the context retrieved from the knowledge graph, do not use preexisting knowledge."
     SYSTEM_MESSAGE += """For example to find out if two fighters had fought each other e.g. did Conor McGregor every compete against Jose Aldo issue the following query: MATCH (a:Fighter)-[]->(f:Fight)<-[]-(b:Fighter) WHERE a.Name = 'Conor McGregor' AND b.Name = 'Jose Aldo' RETURN a, b\n"""
+    if 'FOUGHT' in schema['edges']:
+        SYSTEM_MESSAGE += "Head to head questions are answered by the FOUGHT edges, e.g. how many times did Conor McGregor fight Nate Diaz and how many did he win: MATCH (a:Fighter {Name: 'Conor McGregor'})-[e:FOUGHT]->(b:Fighter {Name: 'Nate Diaz'}) RETURN e.Count, e.Wins, e.First_date, e.Last_date\n"
+    if has_aggregates(schema):
+        SYSTEM_MESSAGE += "Fighter nodes hold precomputed career statistics (Fights, Wins, Losses, Draws, Win_pct between 0 and 1, Fastest_win and Total_fight_time in seconds, Wins_by_<method>, First_fight and Last_fight dates), prefer them over aggregating fights.\n"
   
     # Send the conversation and available functions to the model
     messages = [{"role": "system", "content": SYSTEM_MESSAGE}]
@@ -97,45 +74,58 @@ def main():
     while True:
         question = input("How can I help you with?\n")
         messages.append({"role": "user", "content": question})
-        
-        # Call the function
-        response = client.chat.completions.create(
-            model="gpt-4-turbo-preview",
-            messages=messages,
-            tools=tools,
-            tool_choice="auto",  # auto is default, but we'll be explicit
-        )
+        # bound the history sent to the model
+        messages = trim_history(messages)
 
-        response_message = response.choices[0].message
-        tool_calls = response_message.tool_calls
+        # common questions are answered from prewritten queries
+        answer, context = fast_path(g, question, names, schema)
+        if answer is not None:
+            messages.append({"role": "assistant", "content": answer})
+            print(f"\n{answer}\n")
+            continue
+
+        if context is not None:
+            # the context is already retrieved, only the answer is left to the model
+            messages.append({"role": "system", "content": context})
+            tool_calls = None
+        else:
+            # Call the function
+            response = client.chat.completions.create(
+                model="gpt-4-turbo-preview",
+                messages=messages,
+                tools=tools,
+                tool_choice="auto",  # auto is default, but we'll be explicit
+            )
+
+            response_message = response.choices[0].message
+            tool_calls = response_message.tool_calls
 
         # Check if the model wanted to call a function
         if tool_calls:
             #print(f"response_message: {response_message}")
             messages.append(response_message)  # extend conversation with assistant's reply
             # Send the info for each function call and function response to the model
+            # queries run concurrently, responses are appended in order
             for tool_call in tool_calls:
-                function_name = tool_call.function.name
-                assert(function_name == "run_cypher_query")
-                function_args = json.loads(tool_call.function.arguments)
-                function_response = run_cypher_query(g, function_args.get("query"))
+                assert(tool_call.function.name == "run_cypher_query")
+            queries = [json.loads(tool_call.function.arguments).get("query") for tool_call in tool_calls]
+            responses = run_cypher_queries(g, queries, schema)
+            for tool_call, (function_response, elapsed_ms) in zip(tool_calls, responses):
+                print(f"Query took {elapsed_ms:.0f} ms: {tool_call.function.arguments}")
                 messages.append(
                     {
                         "tool_call_id": tool_call.id,
                         "role": "tool",
-                        "name": function_name,
+                        "name": tool_call.function.name,
                         "content": function_response,
                     }
                 )
-            
-            # extend conversation with function response
-            second_response = client.chat.completions.create(
-                model="gpt-4-turbo-preview",
-                messages=messages,
-            )  # get a new response from the model where it can see the function response
 
-            messages.append({"role": "assistant", "content": second_response.choices[0].message.content})
-            print(f"\n{second_response.choices[0].message.content}\n")
+        if tool_calls or context is not None:
+            # extend conversation with function response
+            # get a new response from the model where it can see the function response
+            answer, _ = stream_answer(client, messages)
+            messages.append({"role": "assistant", "content": answer})
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,102 @@
+"""
+Per-fighter career aggregates, computed in one pass over the parsed fights
+and stored as Fighter attributes, so common questions become node lookups.
+"""
+import re
+
+# attributes every fighter gets, besides the Wins_by_<method> counts
+CAREER_ATTRIBUTES = ['Fights', 'Wins', 'Losses', 'Draws', 'No_contests', 'Win_pct', 'Fastest_win',
+                     'Total_fight_time', 'First_fight', 'Last_fight']
+
+
+# whether the graph's Fighter nodes hold the aggregates, schema as returned by graph_schema
+# the QA prompts only point the model at them when they are there
+def has_aggregates(schema):
+    attributes = schema['nodes'].get('Fighter', {}).get('attributes', {})
+    return all(attr in attributes for attr in CAREER_ATTRIBUTES)
+
+
+# Win methods, e.g. "KO/TKO", "Decision - Split", counted per fighter
+def win_by_attribute(win_by):
+    return "Wins_by_" + re.sub(r"\W+", "_", win_by.replace("'", "")).strip("_")
+
+
+# Round lengths in minutes, e.g. "3 Rnd (5-5-5)" -> [5, 5, 5]
+def round_lengths(fight_format):
+    m = re.search(r"\(([\d-]+)\)", fight_format)
+    if m is None:
+        return []
+    return [int(minutes) for minutes in m[1].split("-")]
+
+
+# Total fight time in seconds, None when unknown
+def fight_seconds(fight):
+    last_round      = fight['fight']['Last_round']
+    last_round_time = fight['fight']['Last_round_time']
+    if last_round is None or last_round_time is None:
+        return None
+
+    previous_rounds = round_lengths(fight['fight']['Format'])[:last_round - 1]
+    return sum(previous_rounds) * 60 + last_round_time
+
+
+def _min(current, value):
+    return value if current is None else min(current, value)
+
+
+def _max(current, value):
+    return value if current is None else max(current, value)
+
+
+# names: fighters to compute aggregates for, fights: all parsed fights
+def fighter_aggregates(names, fights):
+    # every fighter gets every attribute, so they all show up in the schema
+    win_methods = sorted({win_by_attribute(fight['win_by']) for fight in fights if fight['win_by']})
+    aggregates = {name: {'Name': name, 'Fights': 0, 'Wins': 0, 'Losses': 0, 'Draws': 0,
+                         'No_contests': 0, 'Win_pct': 0.0, 'Fastest_win': None,
+                         'Total_fight_time': 0, 'First_fight': None, 'Last_fight': None,
+                         **{method: 0 for method in win_methods}}
+                  for name in names}
+
+    for fight in fights:
+        seconds = fight_seconds(fight)
+        date    = fight['date']
+
+        for name in (fight['R_fighter'], fight['B_fighter']):
+            agg = aggregates.get(name)
+            if agg is None:
+                continue
+
+            agg['Fights'] += 1
+            if seconds is not None:
+                agg['Total_fight_time'] += seconds
+            if date is not None:
+                agg['First_fight'] = _min(agg['First_fight'], date)
+                agg['Last_fight']  = _max(agg['Last_fight'], date)
+
+            if fight['winner'] == name:
+                agg['Wins'] += 1
+                if fight['win_by']:
+                    agg[win_by_attribute(fight['win_by'])] += 1
+                if seconds is not None:
+                    agg['Fastest_win'] = _min(agg['Fastest_win'], seconds)
+            elif fight['winner'] != '':
+                agg['Losses'] += 1
+            elif fight['win_by'].startswith("Decision"):
+                agg['Draws'] += 1
+            else:
+                agg['No_contests'] += 1
+
+    for agg in aggregates.values():
+        if agg['Fights'] > 0:
+            agg['Win_pct'] = agg['Wins'] / agg['Fights']
+
+    return list(aggregates.values())
+
+
+def write_aggregates(g, aggregates):
+    q = """UNWIND $aggregates AS agg
+           MATCH (f:Fighter {Name: agg.Name})
+           SET f += agg"""
+    g.query(q, {'aggregates': aggregates})
+    return len(aggregates)
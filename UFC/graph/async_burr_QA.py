@@ -0,0 +1,230 @@
+"""
+Async version of burr_QA.py, serving many conversations from a single event loop.
+
+The actions use AsyncOpenAI and FalkorDB's asyncio client, so a conversation
+waiting on the model or the database does not block the others. A semaphore
+bounds the number of conversations running at the same time.
+
+Unlike burr_QA.py, every query goes to the primary: replicas.py routes the
+synchronous client only, READ_REPLICAS is not used here.
+"""
+import asyncio
+import json
+import time
+from typing import AsyncGenerator, Optional, Tuple
+
+import openai
+from burr.core import ApplicationBuilder, State, default, expr, Application
+from burr.core.action import action, streaming_action
+from burr.tracking import LocalTrackingClient
+import uuid
+import falkordb
+from falkordb.asyncio import FalkorDB as AsyncFalkorDB
+from falkordb.asyncio.graph import AsyncGraph
+from graph_schema import cached_graph_schema, schema_to_prompt
+from graph_alias import resolve_graph_async
+import intents
+from aggregates import has_aggregates
+from cypher_tool import RESULT_CACHE, plan_cache_stats, run_cypher_queries_async, run_cypher_query_tool_description
+from burr_QA import human_converse, set_inital_chat_history
+
+# conversations answering a question at the same time, the others wait for their turn
+MAX_CONCURRENT_SESSIONS = 100
+
+
+# --- actions
+
+@action(
+    reads=["question", "chat_history"],
+    writes=["chat_history", "fast_path"],
+)
+async def fast_path(state: State, graph: AsyncGraph, names: dict, schema: dict) -> Tuple[dict, State]:
+    """Fast path step -- answer common questions from prewritten queries, skipping the AI steps."""
+    answer, context = await intents.fast_path_async(graph, state["question"], names, schema)
+    new_state = state
+    if answer is not None:
+        # answered from a template, no AI step needed
+        new_state = new_state.append(chat_history={"role": "assistant", "content": answer})
+        route = "answered"
+    elif context is not None:
+        # context retrieved, the AI only needs to phrase the answer
+        new_state = new_state.append(chat_history={"role": "system", "content": context})
+        route = "context"
+    else:
+        route = "ai"
+    return {"fast_path": route, "ai_response": answer}, new_state.update(fast_path=route)
+
+
+@action(
+    reads=["question", "chat_history"],
+    writes=["chat_history", "tool_calls"],
+)
+async def AI_create_cypher_query(state: State,
+                                 client: openai.AsyncOpenAI) -> tuple[dict, State]:
+    """AI step to create the cypher query."""
+    messages = state["chat_history"]
+    # Call the function
+    response = await client.chat.completions.create(
+        model="gpt-4-turbo-preview",
+        messages=messages,
+        tools=[run_cypher_query_tool_description],
+        tool_choice="auto",
+    )
+    response_message = response.choices[0].message
+    new_state = state.append(chat_history=response_message.to_dict())
+    tool_calls = response_message.tool_calls
+    if tool_calls:
+        new_state = new_state.update(tool_calls=tool_calls)
+    return {"ai_response": response_message.content,
+            "usage": response.usage.to_dict()}, new_state
+
+
+@action(
+    reads=["tool_calls", "chat_history"],
+    writes=["tool_calls", "chat_history"],
+)
+async def tool_call(state: State, graph: AsyncGraph, schema: dict) -> Tuple[dict, State]:
+    """Tool call step -- execute the tool calls concurrently."""
+    tool_calls = state.get("tool_calls", [])
+    new_state = state
+    result = {"tool_calls": []}
+    for tool_call in tool_calls:
+        assert (tool_call.function.name == "run_cypher_query")
+    queries = [json.loads(tool_call.function.arguments).get("query") for tool_call in tool_calls]
+    responses = await run_cypher_queries_async(graph, queries, schema)
+    for tool_call, (function_response, elapsed_ms) in zip(tool_calls, responses):
+        new_state = new_state.append(chat_history=
+        {
+            "tool_call_id": tool_call.id,
+            "role": "tool",
+            "name": tool_call.function.name,
+            "content": function_response,
+        }
+        )
+        result["tool_calls"].append(
+            {"tool_call_id": tool_call.id, "response": function_response, "elapsed_ms": elapsed_ms})
+    new_state = new_state.update(tool_calls=[])
+    result["cache"] = RESULT_CACHE.stats()
+    result["plan_cache"] = plan_cache_stats()
+    return result, new_state
+
+
+@streaming_action(
+    reads=["chat_history"],
+    writes=["chat_history"],
+)
+async def AI_generate_response(state: State,
+                               client: openai.AsyncOpenAI) -> AsyncGenerator[Tuple[dict, Optional[State]], None]:
+    """AI step to generate the response, streamed token by token as it is generated."""
+    messages = state["chat_history"]
+    start = time.perf_counter()
+    time_to_first_token_ms = None
+    stream = await client.chat.completions.create(
+        model="gpt-4-turbo-preview",
+        messages=messages,
+        stream=True,
+    )  # get a new response from the model where it can see the function response
+    content = []
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            if time_to_first_token_ms is None:
+                time_to_first_token_ms = (time.perf_counter() - start) * 1000
+            content.append(delta)
+            yield {"delta": delta}, None  # partial result, the state is updated once the stream ends
+    response = "".join(content)
+    new_state = state.append(chat_history={"role": "assistant", "content": response})
+    yield {"ai_response": response,
+           "time_to_first_token_ms": time_to_first_token_ms,
+           "total_ms": (time.perf_counter() - start) * 1000}, new_state
+
+
+# everything a conversation needs from the graph, loaded once and shared by all conversations
+# questions are answered from db_client, the primary, read replicas are not used by the async agent
+# schema_db: synchronous client, only used to introspect the schema when it is not cached
+async def load_graph(db_client: AsyncFalkorDB, graph_name: str, schema_db: falkordb.FalkorDB) -> dict:
+    # get the graph, following the pointer to its live version
+    graph = db_client.select_graph(await resolve_graph_async(db_client, graph_name))
+    # get schema, reused across runs while the graph is unchanged
+    schema = await asyncio.to_thread(cached_graph_schema, schema_db.select_graph(graph.name))
+    return {
+        'graph': graph,
+        'schema': schema,
+        'schema_prompt': schema_to_prompt(schema),
+        # fighter names recognized by the fast path
+        'names': await intents.fighter_names_async(graph),
+    }
+
+
+def build_application(
+        loaded_graph: dict,
+        application_run_id: str,
+        openai_client: openai.AsyncOpenAI) -> Application:
+    """Builds the application, loaded_graph comes from load_graph."""
+    graph  = loaded_graph['graph']
+    schema = loaded_graph['schema']
+    # set the initial chat history
+    base_messages = set_inital_chat_history(loaded_graph['schema_prompt'], 'FOUGHT' in schema['edges'],
+                                            has_aggregates(schema))
+
+    tracker = LocalTrackingClient("ufc-falkor")
+    # create graph
+    burr_application = (
+        ApplicationBuilder()
+        .with_actions(  # define the actions
+            AI_create_cypher_query.bind(client=openai_client),
+            tool_call.bind(graph=graph, schema=schema),
+            AI_generate_response.bind(client=openai_client),
+            fast_path.bind(graph=graph, names=loaded_graph['names'], schema=schema),
+            human_converse
+        )
+        .with_transitions(  # define the edges between the actions based on state conditions
+            ("human_converse", "fast_path", default),
+            ("fast_path", "human_converse", expr("fast_path == 'answered'")),
+            ("fast_path", "AI_generate_response", expr("fast_path == 'context'")),
+            ("fast_path", "AI_create_cypher_query", default),
+            ("AI_create_cypher_query", "tool_call", expr("len(tool_calls)>0")),
+            ("AI_create_cypher_query", "human_converse", default),
+            ("tool_call", "AI_generate_response", default),
+            ("AI_generate_response", "human_converse", default)
+        )
+        .with_identifiers(app_id=application_run_id)
+        .with_state(  # initial state
+            **{"chat_history": base_messages, "tool_calls": []},
+        )
+        .with_entrypoint("human_converse")
+        .with_tracker(tracker)
+        .build()
+    )
+    return burr_application
+
+
+# answer a question within a conversation, waiting for a free slot first
+async def ask(app: Application, question: str, sessions: asyncio.Semaphore) -> str:
+    async with sessions:
+        _, _, state = await app.arun(
+            halt_before=["human_converse"],
+            inputs={"user_question": question},
+        )
+    return state['chat_history'][-1]['content']
+
+
+async def main():
+    _client = openai.AsyncOpenAI()
+    _db_client = AsyncFalkorDB(host='localhost', port=6379)
+    _loaded_graph = await load_graph(_db_client, "UFC", falkordb.FalkorDB(host='localhost', port=6379))
+    _sessions = asyncio.Semaphore(MAX_CONCURRENT_SESSIONS)
+
+    # a single conversation from the terminal, ask() serves any number of them concurrently
+    _app = build_application(_loaded_graph, str(uuid.uuid4()), _client)
+    while True:
+        question = await asyncio.to_thread(input, "What can I help you with?\n")
+        if question == "exit":
+            break
+        print(f"AI: {await ask(_app, question, _sessions)}\n")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,50 @@
+"""
+Micro-benchmark of the fight transform, per-row apply vs. the vectorized transformed_data.
+
+From the ./UFC/graph folder run:
+    python benchmark_transform.py 1 10 100
+to time both paths on the raw data replicated 1, 10 and 100 times.
+"""
+import sys
+import time
+import pandas as pd
+import utils
+import ingest_fights
+
+
+def per_row_transformed_data(raw_total_fight_data: pd.DataFrame) -> pd.DataFrame:
+    """The per-row transform, one Python call per cell"""
+    _df = raw_total_fight_data.rename(columns=lambda c: c.rstrip("."))
+    for col in ingest_fights.RATIO_COLUMNS:
+        _df[col] = _df[col].apply(lambda x: utils.percentage_from_ratio(x))
+    for col in ingest_fights.PERCENTAGE_COLUMNS:
+        _df[col] = _df[col].apply(lambda x: utils.percentage_to_float(x) if '%' in x else None)
+    for col in ingest_fights.COUNT_COLUMNS:
+        _df[col] = _df[col].apply(lambda x: int(x))
+    for col in ingest_fights.TIME_COLUMNS:
+        _df[col] = _df[col].apply(lambda x: utils.time_to_seconds(x) if ':' in x else None)
+    _df["date"] = _df["date"].apply(lambda x: utils.date_to_timestamp(x))
+    _df["Loser"] = _df.apply(
+        lambda x: x["B_fighter"] if x["Winner"] == x["R_fighter"] else x["R_fighter"], axis=1)
+    return _df
+
+
+def timed(transform, raw: pd.DataFrame) -> float:
+    start = time.perf_counter()
+    transform(raw)
+    return time.perf_counter() - start
+
+
+def main(scales: list[int]):
+    raw = ingest_fights.raw_total_fight_data()
+
+    for scale in scales:
+        data = pd.concat([raw] * scale, ignore_index=True)
+        per_row = timed(per_row_transformed_data, data)
+        vectorized = timed(ingest_fights.transformed_data, data)
+        print(f"{len(data):>9} rows: per-row {per_row * 1000:10.1f} ms, "
+              f"vectorized {vectorized * 1000:8.1f} ms, {per_row / vectorized:6.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(scale) for scale in sys.argv[1:]] or [1, 10])
@@ -1,54 +1,25 @@
 import json
-from typing import Tuple
+from typing import Generator, Optional, Tuple
 
 import openai
 from burr.core import ApplicationBuilder, State, default, expr, Application
-from burr.core.action import action
+from burr.core.action import action, streaming_action
 from burr.tracking import LocalTrackingClient
+import time
 import uuid
 from falkordb import FalkorDB
-from graph_schema import graph_schema
+from graph_schema import cached_graph_schema, schema_to_prompt
+from graph_alias import resolve_graph
+import replicas
+import intents
+from aggregates import has_aggregates
+from chat_history import trim_history
+from cypher_tool import RESULT_CACHE, plan_cache_stats, run_cypher_queries, run_cypher_query_tool_description
 import falkordb
 
 
 # --- helper functions
-def schema_to_prompt(schema):
-    prompt = "The Knowledge graph contains nodes of the following types:\n"
-
-    for node in schema['nodes']:
-        lbl = node
-        node = schema['nodes'][node]
-        if len(node['attributes']) > 0:
-            prompt += f"The {lbl} node type has the following set of attributes:\n"
-            for attr in node['attributes']:
-                t = node['attributes'][attr]['type']
-                prompt += f"The {attr} attribute is of type {t}\n"
-        else:
-            prompt += f"The {node} node type has no attributes:\n"
-
-    prompt += "In addition the Knowledge graph contains edge of the following types:\n"
-
-    for edge in schema['edges']:
-        rel = edge
-        edge = schema['edges'][edge]
-        if len(edge['attributes']) > 0:
-            prompt += f"The {rel} edge type has the following set of attributes:\n"
-            for attr in edge['attributes']:
-                t = edge['attributes'][attr]['type']
-                prompt += f"The {attr} attribute is of type {t}\n"
-        else:
-            prompt += f"The {rel} edge type has no attributes:\n"
-
-        prompt += f"The {rel} edge connects the following entities:\n"
-        for conn in edge['connects']:
-            src = conn[0]
-            dest = conn[1]
-            prompt += f"{src} is connected via {rel} to {dest}, (:{src})-[:{rel}]->(:{dest})\n"
-
-    return prompt
-
-
-def set_inital_chat_history(schema_prompt: str) -> list[dict]:
+def set_inital_chat_history(schema_prompt: str, head_to_head: bool = False, career_stats: bool = False) -> list[dict]:
     SYSTEM_MESSAGE = "You are a Cypher expert with access to a directed knowledge graph\n"
     SYSTEM_MESSAGE += schema_prompt
     SYSTEM_MESSAGE += ("Query the knowledge graph to extract relevant information to help you answer the users "
@@ -58,59 +29,56 @@ def set_inital_chat_history(schema_prompt: str) -> list[dict]:
                        "every compete against Jose Aldo issue the following query: "
                        "MATCH (a:Fighter)-[]->(f:Fight)<-[]-(b:Fighter) WHERE a.Name = 'Conor McGregor' AND "
                        "b.Name = 'Jose Aldo' RETURN a, b\n")
+    if head_to_head:
+        SYSTEM_MESSAGE += ("Head to head questions are answered by the FOUGHT edges, e.g. how many times did "
+                           "Conor McGregor fight Nate Diaz and how many did he win: "
+                           "MATCH (a:Fighter {Name: 'Conor McGregor'})-[e:FOUGHT]->(b:Fighter {Name: 'Nate Diaz'}) "
+                           "RETURN e.Count, e.Wins, e.First_date, e.Last_date\n")
+    if career_stats:
+        SYSTEM_MESSAGE += ("Fighter nodes hold precomputed career statistics (Fights, Wins, Losses, Draws, "
+                           "Win_pct between 0 and 1, Fastest_win and Total_fight_time in seconds, "
+                           "Wins_by_<method>, First_fight and Last_fight dates), prefer them over aggregating "
+                           "fights.\n")
 
     messages = [{"role": "system", "content": SYSTEM_MESSAGE}]
     return messages
 
 
-# ---  tools
-
-def run_cypher_query(graph, query):
-    try:
-        results = graph.ro_query(query).result_set
-    except:
-        results = {"error": "Query failed please try a different variation of this query"}
-
-    if len(results) == 0:
-        results = {
-            "error": "The query did not return any data, please make sure you're using the right edge "
-                     "directions and you're following the correct graph schema"}
-
-    return str(results)
-
-
-run_cypher_query_tool_description = {
-    "type": "function",
-    "function": {
-        "name": "run_cypher_query",
-        "description": "Runs a Cypher query against the knowledge graph",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "query": {
-                    "type": "string",
-                    "description": "Query to execute",
-                },
-            },
-            "required": ["query"],
-        },
-    },
-}
-
-
 # --- actions
 
 @action(
-    reads=[],
+    reads=["chat_history"],
     writes=["question", "chat_history"],
 )
 def human_converse(state: State, user_question: str) -> Tuple[dict, State]:
-    """Human converse step -- make sure we get input, and store it as state."""
+    """Human converse step -- make sure we get input, and store it as state, bounding the chat history."""
     new_state = state.update(question=user_question)
-    new_state = new_state.append(chat_history={"role": "user", "content": user_question})
+    chat_history = trim_history(state["chat_history"] + [{"role": "user", "content": user_question}])
+    new_state = new_state.update(chat_history=chat_history)
     return {"question": user_question}, new_state
 
 
+@action(
+    reads=["question", "chat_history"],
+    writes=["chat_history", "fast_path"],
+)
+def fast_path(state: State, graph: falkordb.Graph, names: dict, schema: dict) -> Tuple[dict, State]:
+    """Fast path step -- answer common questions from prewritten queries, skipping the AI steps."""
+    answer, context = intents.fast_path(graph, state["question"], names, schema)
+    new_state = state
+    if answer is not None:
+        # answered from a template, no AI step needed
+        new_state = new_state.append(chat_history={"role": "assistant", "content": answer})
+        route = "answered"
+    elif context is not None:
+        # context retrieved, the AI only needs to phrase the answer
+        new_state = new_state.append(chat_history={"role": "system", "content": context})
+        route = "context"
+    else:
+        route = "ai"
+    return {"fast_path": route, "ai_response": answer}, new_state.update(fast_path=route)
+
+
 @action(
     reads=["question", "chat_history"],
     writes=["chat_history", "tool_calls"],
@@ -139,61 +107,96 @@ def AI_create_cypher_query(state: State,
     reads=["tool_calls", "chat_history"],
     writes=["tool_calls", "chat_history"],
 )
-def tool_call(state: State, graph: falkordb.Graph) -> Tuple[dict, State]:
+def tool_call(state: State, graph: falkordb.Graph, schema: dict) -> Tuple[dict, State]:
     """Tool call step -- execute the tool call."""
     tool_calls = state.get("tool_calls", [])
     new_state = state
     result = {"tool_calls": []}
     for tool_call in tool_calls:
-        function_name = tool_call.function.name
-        assert (function_name == "run_cypher_query")
-        function_args = json.loads(tool_call.function.arguments)
-        function_response = run_cypher_query(graph, function_args.get("query"))
+        assert (tool_call.function.name == "run_cypher_query")
+    # the model's queries run concurrently, their responses are appended in order
+    queries = [json.loads(tool_call.function.arguments).get("query") for tool_call in tool_calls]
+    responses = run_cypher_queries(graph, queries, schema)
+    for tool_call, (function_response, elapsed_ms) in zip(tool_calls, responses):
         new_state = new_state.append(chat_history=
         {
             "tool_call_id": tool_call.id,
             "role": "tool",
-            "name": function_name,
+            "name": tool_call.function.name,
             "content": function_response,
         }
         )
         result["tool_calls"].append(
-            {"tool_call_id": tool_call.id, "response": function_response})
+            {"tool_call_id": tool_call.id, "response": function_response, "elapsed_ms": elapsed_ms})
     new_state = new_state.update(tool_calls=[])
+    result["cache"] = RESULT_CACHE.stats()
+    result["plan_cache"] = plan_cache_stats()
     return result, new_state
 
 
-@action(
+@streaming_action(
     reads=["chat_history"],
     writes=["chat_history"],
 )
-def AI_generate_response(state: State, client: openai.Client) -> tuple[dict, State]:
-    """AI step to generate the response."""
+def AI_generate_response(state: State, client: openai.Client) -> Generator[Tuple[dict, Optional[State]], None, None]:
+    """AI step to generate the response, streamed token by token as it is generated."""
     messages = state["chat_history"]
-    response = client.chat.completions.create(
+    start = time.perf_counter()
+    time_to_first_token_ms = None
+    stream = client.chat.completions.create(
         model="gpt-4-turbo-preview",
         messages=messages,
+        stream=True,
     )  # get a new response from the model where it can see the function response
-    response_message = response.choices[0].message
-    new_state = state.append(chat_history=response_message.to_dict())
-    return {"ai_response": response_message.content,
-            "usage": response.usage.to_dict()}, new_state
+    content = []
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            if time_to_first_token_ms is None:
+                time_to_first_token_ms = (time.perf_counter() - start) * 1000
+            content.append(delta)
+            yield {"delta": delta}, None  # partial result, the state is updated once the stream ends
+    response = "".join(content)
+    new_state = state.append(chat_history={"role": "assistant", "content": response})
+    yield {"ai_response": response,
+           "time_to_first_token_ms": time_to_first_token_ms,
+           "total_ms": (time.perf_counter() - start) * 1000}, new_state
+
+
+# everything a conversation needs from the graph, load it once to share it between conversations
+# reads are spread across replica_clients, the primary db_client's read replicas, when given
+def load_graph(db_client: FalkorDB, graph_name: str, replica_clients: list = ()) -> dict:
+    # get the graph, following the pointer to its live version
+    graph = replicas.read_graph(db_client, resolve_graph(db_client, graph_name), replica_clients)
+    # get schema, reused across runs while the graph is unchanged
+    schema = cached_graph_schema(graph)
+    return {
+        'graph': graph,
+        'schema': schema,
+        # create a prompt from it
+        'schema_prompt': schema_to_prompt(schema),
+        # fighter names recognized by the fast path
+        'names': intents.fighter_names(graph),
+    }
 
 
 def build_application(
         db_client: FalkorDB,
         graph_name: str,
         application_run_id: str,
-        openai_client: openai.OpenAI) -> Application:
-    """Builds the application."""
-    # get the graph
-    graph = db_client.select_graph(graph_name)
-    # get schema
-    schema = graph_schema(graph)
-    # create a prompt from it
-    schema_prompt = schema_to_prompt(schema)
+        openai_client: openai.OpenAI,
+        loaded_graph: Optional[dict] = None) -> Application:
+    """Builds the application, loaded_graph (see load_graph) is loaded from db_client when not given."""
+    if loaded_graph is None:
+        loaded_graph = load_graph(db_client, graph_name)
+    graph  = loaded_graph['graph']
+    schema = loaded_graph['schema']
+    names  = loaded_graph['names']
     # set the initial chat history
-    base_messages = set_inital_chat_history(schema_prompt)
+    base_messages = set_inital_chat_history(loaded_graph['schema_prompt'], 'FOUGHT' in schema['edges'],
+                                            has_aggregates(schema))
 
     tracker = LocalTrackingClient("ufc-falkor")
     # create graph
@@ -201,12 +204,16 @@ def build_application(
         ApplicationBuilder()
         .with_actions(  # define the actions
             AI_create_cypher_query.bind(client=openai_client),
-            tool_call.bind(graph=graph),
+            tool_call.bind(graph=graph, schema=schema),
             AI_generate_response.bind(client=openai_client),
+            fast_path.bind(graph=graph, names=names, schema=schema),
             human_converse
         )
         .with_transitions(  # define the edges between the actions based on state conditions
-            ("human_converse", "AI_create_cypher_query", default),
+            ("human_converse", "fast_path", default),
+            ("fast_path", "human_converse", expr("fast_path == 'answered'")),
+            ("fast_path", "AI_generate_response", expr("fast_path == 'context'")),
+            ("fast_path", "AI_create_cypher_query", default),
             ("AI_create_cypher_query", "tool_call", expr("len(tool_calls)>0")),
             ("AI_create_cypher_query", "human_converse", default),
             ("tool_call", "AI_generate_response", default),
@@ -233,7 +240,9 @@ if __name__ == '__main__':
     _graph_name = "UFC"
     _app_run_id = str(uuid.uuid4())  # this is a unique identifier for the application run
     # build the app
-    _app = build_application(_db_client, _graph_name, _app_run_id, _client)
+    # questions are answered from the read replicas, if any are configured
+    _loaded_graph = load_graph(_db_client, _graph_name, replicas.replica_clients())
+    _app = build_application(_db_client, _graph_name, _app_run_id, _client, _loaded_graph)
 
     # visualize the app
     _app.visualize(
@@ -246,8 +255,18 @@ if __name__ == '__main__':
         if question == "exit":
             break
         print(f"Human: {question}")
-        action, _, state = _app.run(
+        # stream the answer as it is generated, other answers are printed once ready
+        action, streaming_container = _app.stream_result(
+            halt_after=["AI_generate_response"],
             halt_before=["human_converse"],
             inputs={"user_question": question},
         )
-        print(f"AI: {state['chat_history'][-1]['content']}\n")
+        print("AI: ", end="", flush=True)
+        streamed = False
+        for item in streaming_container:
+            print(item["delta"], end="", flush=True)
+            streamed = True
+        _, state = streaming_container.get()
+        if not streamed:
+            print(state['chat_history'][-1]['content'], end="")
+        print("\n")
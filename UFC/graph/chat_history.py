@@ -0,0 +1,122 @@
+"""
+Bounded chat history.
+
+Every completion is sent the whole chat history, left to grow each turn is
+slower and costlier than the last. trim_history keeps the system prompt and the
+last MAX_TURNS turns, shrinks the retrieved context (tool results and context
+messages) of earlier turns to a short summary, and drops the oldest turns until
+the history fits TOKEN_BUDGET.
+
+Tokens are counted with tiktoken when available, otherwise estimated at four
+characters per token.
+"""
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# turns kept, a turn starts at the user's question
+MAX_TURNS = 8
+
+# tokens of the system prompt and earlier turns sent to the model, the turn being answered comes on top
+TOKEN_BUDGET = 8000
+
+# retrieved context of earlier turns is cut down to this many characters
+CONTEXT_SUMMARY_CHARS = 300
+
+# tokens every message costs on top of its content
+MESSAGE_OVERHEAD = 4
+
+# maximum number of distinct texts memoized by count_tokens
+CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # e.g. the encoding can't be downloaded
+        print(f"tiktoken unavailable, estimating tokens from characters: {e}")
+        return None
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def count_tokens(text):
+    encoding = _encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+# messages are dicts, or the message objects returned by the OpenAI client
+def _get(message, key):
+    return message.get(key) if isinstance(message, dict) else getattr(message, key, None)
+
+
+def message_tokens(message):
+    tokens = MESSAGE_OVERHEAD + count_tokens(_get(message, 'content') or "")
+    for tool_call in _get(message, 'tool_calls') or []:
+        function = _get(tool_call, 'function')
+        tokens += count_tokens(_get(function, 'arguments') or "")
+    return tokens
+
+
+def history_tokens(messages):
+    return sum(message_tokens(message) for message in messages)
+
+
+# split messages into the system prompt and turns
+# a turn starts at the user's question, consecutive user messages (question and context) belong to it
+def _turns(messages):
+    start = 0
+    while start < len(messages) and _get(messages[start], 'role') == 'system':
+        start += 1
+
+    turns = []
+    previous = None
+    for message in messages[start:]:
+        role = _get(message, 'role')
+        if (role == 'user' and previous != 'user') or not turns:
+            turns.append([])
+        turns[-1].append(message)
+        previous = role
+    return messages[:start], turns
+
+
+# whether the message carries context retrieved for the question rather than the conversation itself
+def _is_context(message, position):
+    role = _get(message, 'role')
+    return role in ('tool', 'system') or (role == 'user' and position > 0)
+
+
+def _summarize(message):
+    content = _get(message, 'content') or ""
+    if len(content) <= CONTEXT_SUMMARY_CHARS:
+        return message
+    summary = dict(message) if isinstance(message, dict) else message.to_dict()
+    summary['content'] = (content[:CONTEXT_SUMMARY_CHARS] +
+                          f" ... [{len(content) - CONTEXT_SUMMARY_CHARS} characters of an earlier result omitted]")
+    return summary
+
+
+# chat history to send to the model, the last turn (the one being answered) is kept whole
+def trim_history(messages, max_turns=MAX_TURNS, token_budget=TOKEN_BUDGET):
+    prompt, turns = _turns(messages)
+    if not turns:
+        return list(messages)
+
+    turns = turns[-max_turns:]
+    earlier = [[_summarize(m) if _is_context(m, i) else m for i, m in enumerate(turn)] for turn in turns[:-1]]
+
+    # drop the oldest turns past the budget
+    tokens = [history_tokens(turn) for turn in earlier]
+    while earlier and history_tokens(prompt) + sum(tokens) > token_budget:
+        earlier.pop(0)
+        tokens.pop(0)
+
+    return prompt + [m for turn in earlier for m in turn] + turns[-1]
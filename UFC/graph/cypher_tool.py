@@ -0,0 +1,489 @@
+"""
+The run_cypher_query tool shared by the QA agents.
+
+Literals in the queries the LLM generates are lifted into parameters, so
+FalkorDB reuses the execution plans of queries differing only in their
+literals. Every query is read only, so results are cached, keyed on the
+graph, the normalized query text and its parameters. Entries expire
+after CACHE_TTL seconds and the whole cache is dropped once a load bumps the
+graph's ingest version, checked at most every VERSION_CHECK_INTERVAL seconds.
+"""
+import asyncio
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from falkordb import Edge, Node, Path
+import ingest_state
+from cypher_validator import validate_query
+
+CACHE_SIZE             = 1024  # entries
+CACHE_TTL              = 300   # seconds
+VERSION_CHECK_INTERVAL = 5     # seconds
+
+# queries of a single model turn run concurrently, bounded across all agents in the process
+TOOL_WORKERS = 8
+
+# tool results are cut down to fit the prompt, roughly 1000 tokens
+MAX_ROWS  = 50
+MAX_CHARS = 4000
+
+# queries running longer are aborted by FalkorDB
+QUERY_TIMEOUT = 5000  # ms
+
+# check every query's execution plan before running it
+EXPLAIN_GUARD = True
+
+# labels too large to scan without an aggregation or LIMIT, scans of them are limited
+GUARDED_LABELS = {'Fight'}
+
+# count the rows of a query before running it, so oversized results are fetched with a LIMIT
+COUNT_PROBE = False
+
+run_cypher_query_tool_description = {
+    "type": "function",
+    "function": {
+        "name": "run_cypher_query",
+        "description": "Runs a Cypher query against the knowledge graph, returns a table of at most "
+                       f"{MAX_ROWS} rows. Return the attributes you need rather than whole nodes.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {
+                    "type": "string",
+                    "description": "Query to execute",
+                },
+            },
+            "required": ["query"],
+        },
+    },
+}
+
+
+# string literals, left untouched by normalize_query
+STRING_LITERAL = re.compile(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")""")
+
+# tokens of a query, as far as lifting literals into parameters is concerned
+TOKEN = re.compile(r"""(?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")"""
+                   r"|(?P<quoted>`[^`]*`)"
+                   r"|(?P<name>\$?[A-Za-z_][A-Za-z0-9_]*)"
+                   r"|(?P<number>\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)"
+                   r"|(?P<other>\.\.|\S)")
+
+# comments, string literals are matched as well to leave their content untouched
+COMMENT = re.compile(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")|//[^\n]*|/\*.*?\*/""", re.DOTALL)
+
+# escape sequences of Cypher string literals
+ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f'}
+
+# keywords whose numeric argument has to stay a literal
+LITERAL_ONLY = {'LIMIT', 'SKIP'}
+
+
+# collapse whitespace outside string literals and drop a trailing semicolon,
+# so formatting variations of a query share a cache entry
+def normalize_query(query):
+    parts = STRING_LITERAL.split(query)
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r"\s+", " ", parts[i])
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def _string_value(literal):
+    return re.sub(r"\\(.)", lambda m: ESCAPES.get(m[1], m[1]), literal[1:-1])
+
+
+# lift string and numeric literals into parameters, e.g.
+# WHERE a.Name = 'Conor McGregor' -> WHERE a.Name = $p0, {'p0': 'Conor McGregor'}
+# so queries differing only in their literals share a single execution plan
+# numbers in LIMIT, SKIP and variable length patterns (*1..3) stay literals
+def parameterize(query):
+    # leave queries which already use parameters alone, lifted names could clash
+    if '$' in STRING_LITERAL.sub("", query):
+        return query, {}
+
+    tokens = list(TOKEN.finditer(query))
+    params = {}
+    parts  = []
+    end    = 0  # end of the query text copied so far
+
+    for i, token in enumerate(tokens):
+        kind, text = token.lastgroup, token.group()
+        prev = tokens[i - 1].group() if i > 0 else ""
+        nxt  = tokens[i + 1].group() if i + 1 < len(tokens) else ""
+
+        if kind == 'string':
+            value = _string_value(text)
+        elif kind == 'number' and prev.upper() not in LITERAL_ONLY and prev not in ('*', '..') and nxt != '..':
+            value = float(text) if re.search(r"[.eE]", text) else int(text)
+        else:
+            continue
+
+        name = f"p{len(params)}"
+        params[name] = value
+        parts.append(query[end:token.start()] + f"${name}")
+        end = token.end()
+
+    parts.append(query[end:])
+    return "".join(parts), params
+
+
+# number of queries FalkorDB executed from a cached plan, and planned from scratch
+_plan_cache = {'hits': 0, 'misses': 0}
+_plan_cache_lock = threading.Lock()
+
+
+def plan_cache_stats():
+    with _plan_cache_lock:
+        hits, misses = _plan_cache['hits'], _plan_cache['misses']
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_rate': hits / total if total else 0.0}
+
+
+class ResultCache:
+    """Bounded LRU cache with a per entry TTL, safe to share between threads"""
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+        self.maxsize   = maxsize
+        self.ttl       = ttl
+        self.hits      = 0
+        self.misses    = 0
+        self._entries  = OrderedDict()  # key -> (expires at, value)
+        self._versions = {}             # graph name -> (checked at, ingest version)
+        self._lock     = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    # whether the graph's ingest version is due to be checked again
+    def version_due(self, name):
+        with self._lock:
+            checked = self._versions.get(name)
+        return checked is None or time.monotonic() - checked[0] >= VERSION_CHECK_INTERVAL
+
+    # record the graph's ingest version, every entry is dropped once it changes
+    def set_version(self, name, version):
+        with self._lock:
+            checked = self._versions.get(name)
+            if checked is not None and checked[1] != version:
+                self._entries.clear()
+            self._versions[name] = (time.monotonic(), version)
+
+    def check_version(self, graph):
+        if self.version_due(graph.name):
+            self.set_version(graph.name, ingest_state.read_state(graph).get('Version'))
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+# shared by every agent in the process
+RESULT_CACHE = ResultCache()
+
+
+# strings nested in maps and lists are quoted, table cells are not
+def _format_nested(value):
+    return repr(value) if isinstance(value, str) else format_value(value)
+
+
+# compact rendering of a single value, nodes and edges are reduced to their label and Name
+def format_value(value):
+    if isinstance(value, Node):
+        props = {k: v for k, v in value.properties.items() if not k.startswith('_')}
+        if 'Name' in props:
+            props = {'Name': props['Name']}
+        return f"(:{':'.join(value.labels or [])} {format_value(props)})"
+    if isinstance(value, Edge):
+        return f"[:{value.relation} {format_value(value.properties)}]"
+    if isinstance(value, Path):
+        return "->".join(format_value(node) for node in value.nodes())
+    if isinstance(value, dict):
+        return "{" + ", ".join(f"{k}: {_format_nested(v)}" for k, v in value.items()) + "}"
+    if isinstance(value, list):
+        return "[" + ", ".join(_format_nested(v) for v in value) + "]"
+    if isinstance(value, float):
+        return str(round(value, 4))
+    if value is None:
+        return "null"
+    return str(value)
+
+
+# render a result as a table of its projected columns, bounded by MAX_ROWS and MAX_CHARS
+# total: number of rows the query produces, when known to exceed the ones fetched
+# limited: the query was given an automatic LIMIT of max_rows + 1, more rows than that means it was cut
+def format_results(header, rows, total=None, max_rows=MAX_ROWS, max_chars=MAX_CHARS, limited=False):
+    columns = [name.decode() if isinstance(name, bytes) else name for _, name in header]
+    table   = " | ".join(columns)
+    cut     = limited and total is None and len(rows) > max_rows
+    total   = max(total or 0, len(rows))
+
+    shown = 0
+    for row in rows[:max_rows]:
+        line = " | ".join(format_value(value) for value in row)
+        if len(table) + len(line) + 1 > max_chars:
+            break
+        table += "\n" + line
+        shown += 1
+
+    if cut:
+        table += (f"\n... more rows not shown, the result has more than {max_rows} rows and was cut short by "
+                  f"an automatic LIMIT, only the first {shown} are listed. "
+                  "Aggregate or filter further if you need them.")
+    elif shown < total:
+        table += (f"\n... {total - shown} more rows not shown, {total} rows in total. "
+                  "Aggregate or filter further if you need them.")
+    return table
+
+
+def _count_query(query):
+    return f"CALL {{ {query} }} RETURN count(*)"
+
+
+# rows the query produces, None if it can not be counted
+def count_rows(graph, query, params, timeout=QUERY_TIMEOUT):
+    try:
+        return graph.ro_query(_count_query(query), params, timeout=timeout).result_set[0][0]
+    except Exception:
+        return None
+
+
+# query without its comments
+def strip_comments(query):
+    return COMMENT.sub(lambda m: m[1] or " ", query)
+
+
+# append a LIMIT to queries that do not end with one, UNIONs are left alone
+# comments are stripped first, a trailing // comment would swallow the LIMIT
+def limit_query(query, limit):
+    stripped = strip_comments(query)
+    if re.search(r"\bUNION\b", stripped, re.IGNORECASE) or \
+       re.search(r"\bLIMIT\s+\S+\s*;?\s*$", stripped, re.IGNORECASE):
+        return query
+    return f"{stripped.rstrip().rstrip(';')} LIMIT {limit}"
+
+
+# structured error the model can act upon
+def query_error(reason, message, hint):
+    return str({"error": message, "reason": reason, "hint": hint})
+
+
+# labels of GUARDED_LABELS scanned in full by the plan rooted at op
+def _guarded_scans(op):
+    scanned = set()
+    if op.name == "Node By Label Scan":
+        scanned.update(re.findall(r":(\w+)", op.args or ""))
+    for child in op.children:
+        scanned |= _guarded_scans(child)
+    return scanned & GUARDED_LABELS
+
+
+# check a query's execution plan, returns the query to run and an error if it is rejected
+# scans of every node and cartesian products over full scans of GUARDED_LABELS are rejected,
+# other full scans of GUARDED_LABELS that do not aggregate are limited to MAX_ROWS + 1 rows,
+# the extra row tells a result that was cut from one that fits
+def check_plan(plan, query):
+    if plan.collect_operations("All Node Scan"):
+        return query, query_error("all_node_scan",
+                                  "The query scans every node of the graph",
+                                  "Give each node in the pattern a label and filter on indexed attributes")
+
+    for op in plan.collect_operations("Cartesian Product"):
+        scanned = _guarded_scans(op)
+        if scanned:
+            return query, query_error("cartesian_product",
+                                      f"The query combines every {'/'.join(sorted(scanned))} node "
+                                      "with unrelated patterns into a cartesian product",
+                                      "Connect the patterns through edges or split them into separate queries")
+
+    if _guarded_scans(plan.structured_plan) and not plan.collect_operations("Aggregate"):
+        query = limit_query(query, MAX_ROWS + 1)
+
+    return query, None
+
+
+def guard_query(graph, query, params):
+    return check_plan(graph.explain(query, params), query)
+
+
+# validate the query and lift its literals
+# returns an error if the query is missing or does not match the schema, the query and parameters to run and the cache key
+def prepare_query(graph, query, params, lift_literals, schema):
+    # e.g. a tool call without a "query" argument
+    if not isinstance(query, str) or not query.strip():
+        return query_error("missing_query", "No Cypher query was given",
+                           "Call run_cypher_query with the Cypher query as its query argument"), query, params, None
+
+    if schema is not None:
+        errors = validate_query(query, schema)
+        if errors:
+            return query_error("schema_mismatch", "; ".join(errors),
+                               "Correct the query according to the graph schema and try again"), query, params, None
+
+    if lift_literals and not params:
+        query, params = parameterize(query)
+
+    key = (graph.name, normalize_query(query), json.dumps(params, sort_keys=True, default=str))
+    return None, query, params, key
+
+
+# response to a query that raised
+def failed_query(e, timeout):
+    if "timed out" in str(e).lower():
+        return query_error("timeout", f"The query did not complete within {timeout} ms",
+                           "Filter on indexed attributes, use precomputed attributes or add a LIMIT")
+    # failures are not cached, the same query may succeed later
+    return str({"error": "Query failed please try a different variation of this query"})
+
+
+# response to a query that completed, total: rows produced when known from a count probe
+# limited: the query was given an automatic LIMIT by check_plan
+def query_response(result, total, limited=False):
+    with _plan_cache_lock:
+        _plan_cache['hits' if result.cached_execution else 'misses'] += 1
+
+    if len(result.result_set) == 0:
+        return str({
+            "error": "The query did not return any data, please make sure you're using the right edge "
+                     "directions and you're following the correct graph schema"})
+    return format_results(result.header, result.result_set, total, limited=limited)
+
+
+# schema: the graph's schema, queries not matching it are rejected without running them
+def run_cypher_query(graph, query, params=None, cache=RESULT_CACHE, lift_literals=True,
+                     count_probe=COUNT_PROBE, timeout=QUERY_TIMEOUT, explain_guard=EXPLAIN_GUARD,
+                     schema=None):
+    error, query, params, key = prepare_query(graph, query, params, lift_literals, schema)
+    if error is not None:
+        return error
+
+    if cache is not None:
+        cache.check_version(graph)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    limited = False
+    if explain_guard:
+        try:
+            guarded, error = guard_query(graph, query, params)
+            limited, query = guarded != query, guarded
+        except Exception:
+            # queries failing to plan are reported by the query itself
+            error = None
+        if error is not None:
+            if cache is not None:
+                cache.put(key, error)
+            return error
+
+    # fetch just the rows that can be shown when the result is known to be larger
+    total = count_rows(graph, query, params, timeout) if count_probe else None
+    if total is not None and total > MAX_ROWS:
+        query = limit_query(query, MAX_ROWS)
+
+    try:
+        result = graph.ro_query(query, params, timeout=timeout)
+    except Exception as e:
+        return failed_query(e, timeout)
+
+    response = query_response(result, total, limited)
+    if cache is not None:
+        cache.put(key, response)
+    return response
+
+
+# same as run_cypher_query, for FalkorDB's asyncio client
+async def run_cypher_query_async(graph, query, params=None, cache=RESULT_CACHE, lift_literals=True,
+                                 count_probe=COUNT_PROBE, timeout=QUERY_TIMEOUT, explain_guard=EXPLAIN_GUARD,
+                                 schema=None):
+    error, query, params, key = prepare_query(graph, query, params, lift_literals, schema)
+    if error is not None:
+        return error
+
+    if cache is not None:
+        if cache.version_due(graph.name):
+            state = ingest_state.parse_state((await graph.ro_query(ingest_state.STATE_QUERY)).result_set)
+            cache.set_version(graph.name, state.get('Version'))
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    limited = False
+    if explain_guard:
+        try:
+            guarded, error = check_plan(await graph.explain(query, params), query)
+            limited, query = guarded != query, guarded
+        except Exception:
+            # queries failing to plan are reported by the query itself
+            error = None
+        if error is not None:
+            if cache is not None:
+                cache.put(key, error)
+            return error
+
+    total = None
+    if count_probe:
+        try:
+            total = (await graph.ro_query(_count_query(query), params, timeout=timeout)).result_set[0][0]
+        except Exception:
+            total = None
+    if total is not None and total > MAX_ROWS:
+        query = limit_query(query, MAX_ROWS)
+
+    try:
+        result = await graph.ro_query(query, params, timeout=timeout)
+    except Exception as e:
+        return failed_query(e, timeout)
+
+    response = query_response(result, total, limited)
+    if cache is not None:
+        cache.put(key, response)
+    return response
+
+
+# shared by every agent in the process, bounds the number of concurrent queries
+_tool_pool = ThreadPoolExecutor(max_workers=TOOL_WORKERS)
+
+
+def _timed_query(graph, query, schema):
+    start = time.perf_counter()
+    response = run_cypher_query(graph, query, schema=schema)
+    return response, (time.perf_counter() - start) * 1000
+
+
+# run several queries concurrently, returns (response, elapsed ms) pairs in the queries' order
+def run_cypher_queries(graph, queries, schema=None):
+    futures = [_tool_pool.submit(_timed_query, graph, query, schema) for query in queries]
+    return [future.result() for future in futures]
+
+
+async def _timed_query_async(graph, query, schema):
+    start = time.perf_counter()
+    response = await run_cypher_query_async(graph, query, schema=schema)
+    return response, (time.perf_counter() - start) * 1000
+
+
+# same as run_cypher_queries, for FalkorDB's asyncio client
+async def run_cypher_queries_async(graph, queries, schema=None):
+    return await asyncio.gather(*[_timed_query_async(graph, query, schema) for query in queries])
@@ -0,0 +1,119 @@
+"""
+Checks generated Cypher against the graph's schema before running it.
+
+Labels, relationship types, edge directions and attribute names are checked
+locally, mistakes are reported with a precise correction instead of costing a
+round trip to the database and an extra turn of the model.
+"""
+import difflib
+import re
+
+STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.)*'" r'|"(?:[^"\\]|\\.)*"')
+
+# (var:Label:Other {attr: ...})
+NODE_PATTERN = re.compile(r"\(\s*(\w*)\s*((?::\s*\w+\s*)*)(\{[^}]*\})?\s*\)")
+
+# (src)-[var:TYPE|OTHER {attr: ...}]->(dest), matched with a lookahead as patterns chain
+EDGE_PATTERN = re.compile(r"(?=(\([^()]*\))\s*(<?)-\s*\[\s*(\w*)\s*((?::\s*\w+\s*(?:\|\s*:?\s*\w+\s*)*)?)"
+                          r"(\{[^}]*\})?\s*(?:\*[\d.]*\s*)?\]\s*-(>?)\s*(\([^()]*\)))")
+
+# var.attribute
+ATTRIBUTE = re.compile(r"\b([A-Za-z_]\w*)\.([A-Za-z_]\w*)")
+
+# attribute names of a pattern's property map
+MAP_KEYS = re.compile(r"(\w+)\s*:")
+
+
+def _suggest(name, known):
+    match = difflib.get_close_matches(name, known, n=1)
+    return f", did you mean {match[0]}?" if match else f", known ones are: {', '.join(sorted(known))}"
+
+
+def _names(spec, sep):
+    return [name.strip() for name in re.split(sep, spec.replace(":", " ")) if name.strip()]
+
+
+def _labels(node):
+    m = NODE_PATTERN.fullmatch(node.strip())
+    return (m[1], _names(m[2] or "", r"\s+")) if m else ("", [])
+
+
+# list of problems found in query, empty if it matches the schema
+def validate_query(query, schema):
+    query  = STRING_LITERAL.sub("''", query)
+    nodes  = schema['nodes']
+    edges  = schema['edges']
+    errors = []
+
+    def check_attributes(kind, owners, attrs, known):
+        for attr in attrs:
+            if attr.startswith('_') or any(attr in known[o]['attributes'] for o in owners):
+                continue
+            names = {a for o in owners for a in known[o]['attributes']}
+            errors.append(f"{kind} {'/'.join(owners)} has no {attr} attribute" + _suggest(attr, names))
+
+    # ---- nodes ----
+
+    node_vars = {}  # variable -> labels
+    for m in NODE_PATTERN.finditer(query):
+        var, lbls = m[1], _names(m[2] or "", r"\s+")
+        unknown = [lbl for lbl in lbls if lbl not in nodes]
+        for lbl in unknown:
+            errors.append(f"Unknown node label {lbl}" + _suggest(lbl, nodes))
+        if lbls and not unknown:
+            if var:
+                node_vars.setdefault(var, set()).update(lbls)
+            check_attributes("Node", lbls, MAP_KEYS.findall(m[3] or ""), nodes)
+
+    # ---- edges ----
+
+    edge_vars = {}  # variable -> relationship types
+    for m in EDGE_PATTERN.finditer(query):
+        src, incoming, var, types, props, outgoing, dest = m.groups()
+        types = _names(types or "", r"[|\s]+")
+
+        unknown = [rel for rel in types if rel not in edges]
+        for rel in unknown:
+            errors.append(f"Unknown relationship type {rel}" + _suggest(rel, edges))
+        if not types or unknown:
+            continue
+
+        if var:
+            edge_vars.setdefault(var, set()).update(types)
+        check_attributes("Edge", types, MAP_KEYS.findall(props or ""), edges)
+
+        # direction, checked when both endpoints' labels are known
+        src_var, src_lbls   = _labels(src)
+        dest_var, dest_lbls = _labels(dest)
+        src_lbls  = src_lbls or sorted(node_vars.get(src_var, []))
+        dest_lbls = dest_lbls or sorted(node_vars.get(dest_var, []))
+        if any(lbl not in nodes for lbl in src_lbls + dest_lbls):
+            continue  # already reported
+        if not src_lbls or not dest_lbls or bool(incoming) == bool(outgoing):
+            continue
+        if incoming:
+            src_lbls, dest_lbls = dest_lbls, src_lbls
+
+        connects = {tuple(conn) for rel in types for conn in edges[rel]['connects']}
+        pairs    = {(s, d) for s in src_lbls for d in dest_lbls}
+        if pairs & connects:
+            continue
+
+        pattern = "|".join(types)
+        if {(d, s) for s, d in pairs} & connects:
+            errors.append(f"Wrong direction, {pattern} edges go from {'/'.join(dest_lbls)} "
+                          f"to {'/'.join(src_lbls)}, reverse the arrow")
+        else:
+            errors.append(f"{pattern} edges do not connect {'/'.join(src_lbls)} and {'/'.join(dest_lbls)}, "
+                          "they connect: " + ", ".join(f"(:{s})-[:{pattern}]->(:{d})" for s, d in sorted(connects)))
+
+    # ---- attributes ----
+
+    for var, attr in ATTRIBUTE.findall(query):
+        if var in node_vars:
+            check_attributes("Node", sorted(node_vars[var]), [attr], nodes)
+        elif var in edge_vars:
+            check_attributes("Edge", sorted(edge_vars[var]), [attr], edges)
+
+    # report every problem once, in order
+    return list(dict.fromkeys(errors))
@@ -0,0 +1,178 @@
+"""
+Export the raw CSVs as node and edge files for the FalkorDB bulk loader.
+
+Building a large graph from scratch is much faster with the bulk loader
+(https://github.com/FalkorDB/falkordb-bulk-loader) than with Cypher.
+From the ./UFC/graph folder run:
+    python export_bulk.py
+and then the printed falkordb-bulk-insert command, followed by:
+    python export_bulk.py finalize <graph name>
+which indexes the new graph, validates it and points readers at it.
+"""
+import csv
+import os
+import sys
+from falkordb import FalkorDB
+import queries
+import ingest_state
+import graph_alias
+import aggregates
+from ingest import read_fighters, read_fights
+
+OUTPUT_DIR = "../data/bulk"
+
+# Files are loaded with --enforce-schema, every column's header carries its type
+# as the loader would otherwise infer it from the values, e.g. a digits only _hash
+# would load as a number. The first column of every node file is the node's
+# identifier, it is not stored as a property as its header has no name.
+FIGHTER_COLUMNS = ["Name", "Height", "Weight", "Reach", "Stance", "DOB", "SLpM",
+                   "Str_Acc", "SApM", "Str_Def", "TD_Avg", "TD_Acc", "TD_Def", "Sub_Avg"]
+FIGHT_COLUMNS   = ["Last_round", "Last_round_time", "Format", "Fight_type", "_key", "_hash"]
+
+
+# Stable identifiers, derived from each entity's natural key
+def fighter_id(name):
+    return f"fighter:{name}"
+
+def referee_id(name):
+    return f"referee:{name}"
+
+def card_id(date, location):
+    return f"card:{date}:{location}"
+
+def fight_id(key):
+    return f"fight:{key}"
+
+
+# endpoint labels of every relationship type, identifiers are namespaced by label
+EDGE_ENDPOINTS = {
+    "RED":      ("Fight", "Fighter"),
+    "BLUE":     ("Fight", "Fighter"),
+    "PART_OF":  ("Fight", "Card"),
+    "REFEREED": ("Referee", "Fight"),
+    "WON":      ("Fighter", "Fight"),
+    "LOST":     ("Fighter", "Fight"),
+}
+
+
+# bulk loader type of a column from its values, None values are left empty and load as NULL
+def column_type(values):
+    types = {type(value) for value in values if value is not None}
+    if types == {int}:
+        return "INT"
+    if types <= {int, float} and types:
+        return "DOUBLE"
+    if types == {bool}:
+        return "BOOLEAN"
+    return "STRING"
+
+
+# header of a node file, rows start with the node's identifier
+def node_header(label, columns, rows):
+    return [f":ID({label})"] + [f"{col}:{column_type([row[i + 1] for row in rows])}"
+                                for i, col in enumerate(columns)]
+
+
+def write_csv(path, header, rows):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+# parse both CSVs, deduplicate cards and referees in memory
+# returns fighters, all fights and the fights to export with their endpoint IDs
+def resolved_entities():
+    fighters = read_fighters()
+    fights   = read_fights()
+
+    fighter_ids = {fighter['Name']: fighter_id(fighter['Name']) for fighter in fighters}
+    referee_ids = {fight['referee']: referee_id(fight['referee']) for fight in fights}
+    card_ids    = {(fight['date'], fight['location']): card_id(fight['date'], fight['location'])
+                   for fight in fights}
+
+    loaded = queries.resolve_fights(fights, fighter_ids, referee_ids, card_ids)
+    return fighters, fights, loaded
+
+
+def export(output_dir=OUTPUT_DIR):
+    fighters, fights, loaded = resolved_entities()
+    os.makedirs(output_dir, exist_ok=True)
+
+    def path(name):
+        return os.path.join(output_dir, f"{name}.csv")
+
+    # ---- nodes ----
+
+    # fighter attributes along with their career aggregates
+    career = {agg['Name']: agg for agg in
+              aggregates.fighter_aggregates([fighter['Name'] for fighter in fighters], fights)}
+    columns = FIGHTER_COLUMNS + [col for col in next(iter(career.values()), {}) if col != 'Name']
+    rows = [[fighter_id(fighter['Name'])] + [{**fighter, **career[fighter['Name']]}.get(col) for col in columns]
+            for fighter in fighters]
+    write_csv(path("Fighter"), node_header("Fighter", columns, rows), rows)
+
+    rows = [[fight_id(fight['fight']['_key'])] + [fight['fight'][col] for col in FIGHT_COLUMNS]
+            for fight in loaded]
+    write_csv(path("Fight"), node_header("Fight", FIGHT_COLUMNS, rows), rows)
+
+    cards = {(fight['date'], fight['location']): card_id(fight['date'], fight['location'])
+             for fight in fights}
+    rows = [[c_id, date, location] for (date, location), c_id in cards.items()]
+    write_csv(path("Card"), node_header("Card", ["Date", "Location"], rows), rows)
+
+    # the unknown referee's empty name loads as NULL, finalize sets it back to ''
+    referees = {fight['referee']: referee_id(fight['referee']) for fight in fights}
+    rows = [[r_id, name] for name, r_id in referees.items()]
+    write_csv(path("Referee"), node_header("Referee", ["Name"], rows), rows)
+
+    # ---- edges ----
+
+    decided = [fight for fight in loaded if fight['winner_id'] is not None]
+
+    edges = {
+        "RED":      [(fight_id(f['fight']['_key']), f['R_id']) for f in loaded],
+        "BLUE":     [(fight_id(f['fight']['_key']), f['B_id']) for f in loaded],
+        "PART_OF":  [(fight_id(f['fight']['_key']), f['card_id']) for f in loaded],
+        "REFEREED": [(f['referee_id'], fight_id(f['fight']['_key'])) for f in loaded],
+        "WON":      [(f['winner_id'], fight_id(f['fight']['_key'])) for f in decided],
+        "LOST":     [(f['loser_id'], fight_id(f['fight']['_key'])) for f in decided],
+    }
+    for rel, rows in edges.items():
+        src, dest = EDGE_ENDPOINTS[rel]
+        write_csv(path(rel), [f":START_ID({src})", f":END_ID({dest})"], rows)
+
+    print(f"Exported {len(fighters)} fighters, {len(loaded)} fights, {len(cards)} cards "
+          f"and {len(referees)} referees to {output_dir}, load them with:")
+    print(f"falkordb-bulk-insert {graph_alias.staging_graph('UFC')} --enforce-schema "
+          + " ".join(f"--nodes {path(lbl)}" for lbl in ["Fighter", "Fight", "Card", "Referee"]) + " "
+          + " ".join(f"--relations {path(rel)}" for rel in edges))
+
+
+# index a bulk loaded graph, validate it and point readers at it
+def finalize(db, graph_name):
+    g = db.select_graph(graph_name)
+    fighters, fights, loaded = resolved_entities()
+
+    # a bulk loaded graph failing validation is deleted
+    with graph_alias.discard_on_failure(db, g):
+        queries.create_indices(g)
+
+        # empty strings load as NULL, the Cypher loads name the unknown referee ''
+        g.query("MATCH (r:Referee) WHERE r.Name IS NULL SET r.Name = ''")
+
+        live = db.select_graph(graph_alias.resolve_graph(db, "UFC"))
+        base_version = ingest_state.graph_version(db, live)
+        version = ingest_state.write_state(g, fights, base_version)
+
+        graph_alias.validate(g, graph_alias.expected_counts(len(fighters), fights, loaded))
+        graph_alias.promote(db, "UFC", graph_name)
+
+    print(f"All done - graph version {version}")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["finalize"]:
+        finalize(FalkorDB(host='localhost', port=6379), sys.argv[2])
+    else:
+        export()
@@ -0,0 +1,149 @@
+"""
+Blue/green graph versions.
+
+Full loads build a new graph version (e.g. UFC_v20240501120000) next to the
+live one, validate it and only then point readers at it. The pointer is a
+plain Redis key (e.g. UFC:active) which readers resolve when they start.
+Promoted versions are listed, oldest first, under a second key (e.g.
+UFC:versions), the previous version is kept around for rollback. A full load
+failing before its promotion deletes its staging graph, graphs never promoted
+are neither rolled back to nor pruned in place of promoted ones.
+
+To roll back to the previous version, from the ./UFC/graph folder run:
+    python graph_alias.py rollback
+"""
+import sys
+import time
+from contextlib import contextmanager
+from falkordb import FalkorDB
+
+
+def _pointer_key(name):
+    return f"{name}:active"
+
+
+def _history_key(name):
+    return f"{name}:versions"
+
+
+# promoted versions, oldest first
+def _versions(db, name):
+    return db.connection.lrange(_history_key(name), 0, -1)
+
+
+# name of the graph readers should query, falls back to name itself
+def resolve_graph(db, name):
+    active = db.connection.get(_pointer_key(name))
+    return active if active is not None else name
+
+
+# same as resolve_graph, for FalkorDB's asyncio client
+async def resolve_graph_async(db, name):
+    active = await db.connection.get(_pointer_key(name))
+    return active if active is not None else name
+
+
+# name of a new graph version to build into
+def staging_graph(name):
+    return f"{name}_v{time.strftime('%Y%m%d%H%M%S')}"
+
+
+# delete the staging graph g when the block raises, a failed full load leaves no half built version behind
+# discard is False for incremental loads, which update the live graph in place
+@contextmanager
+def discard_on_failure(db, g, discard=True):
+    try:
+        yield g
+    except BaseException:
+        # never the graph readers were already switched to
+        live = resolve_graph(db, g.name.rsplit("_v", 1)[0])
+        if discard and g.name != live and g.name in db.list_graphs():
+            print(f"Load failed, deleting staging graph {g.name}")
+            g.delete()
+        raise
+
+
+# node and edge counts a load is expected to produce
+# fighters: number of fighters, fights: all CSV fights, loaded: fights written
+# fought: whether FOUGHT edges were materialized
+def expected_counts(fighters, fights, loaded, fought=False):
+    decided = sum(1 for fight in loaded if fight['winner'] != '')
+    expected = {
+        'nodes': {
+            'Fighter': fighters,
+            'Fight': len(loaded),
+            'Card': len({(fight['date'], fight['location']) for fight in fights}),
+            'Referee': len({fight['referee'] for fight in fights}),
+        },
+        'edges': {
+            'RED': len(loaded),
+            'BLUE': len(loaded),
+            'PART_OF': len(loaded),
+            'REFEREED': len(loaded),
+            'WON': decided,
+            'LOST': decided,
+        },
+    }
+    if fought:
+        pairs = {frozenset((fight['R_fighter'], fight['B_fighter'])) for fight in loaded}
+        expected['edges']['FOUGHT'] = 2 * len(pairs)
+    return expected
+
+
+# compare the graph's node and edge counts against the expected ones
+def validate(g, expected):
+    mismatches = []
+
+    for lbl, count in expected['nodes'].items():
+        actual = g.query(f"MATCH (n:{lbl}) RETURN count(n)").result_set[0][0]
+        if actual != count:
+            mismatches.append(f"{lbl} nodes: expected {count}, found {actual}")
+
+    for rel, count in expected['edges'].items():
+        actual = g.query(f"MATCH ()-[e:{rel}]->() RETURN count(e)").result_set[0][0]
+        if actual != count:
+            mismatches.append(f"{rel} edges: expected {count}, found {actual}")
+
+    if mismatches:
+        raise ValueError(f"Graph {g.name} failed validation: " + "; ".join(mismatches))
+
+
+# point readers at the staging graph, drop promoted versions older than the last `keep`
+# the version readers were using is kept, for rollback
+def promote(db, name, staging, keep=2):
+    previous = resolve_graph(db, name)
+    versions = _versions(db, name)
+    if not versions and previous != staging and previous in db.list_graphs():
+        # promoted before versions were listed
+        db.connection.rpush(_history_key(name), previous)
+
+    db.connection.rpush(_history_key(name), staging)
+    db.connection.set(_pointer_key(name), staging)
+    print(f"{name} now points to {staging}")
+
+    versions = _versions(db, name)
+    kept = set(versions[-keep:]) | {previous, staging}
+    for version in versions:
+        if version in kept:
+            continue
+        # the unversioned graph predates the versions, it is left alone
+        if version.startswith(f"{name}_v") and version in db.list_graphs():
+            db.select_graph(version).delete()
+        db.connection.lrem(_history_key(name), 0, version)
+
+
+# point readers back at the promoted version preceding the active one
+def rollback(db, name):
+    versions = _versions(db, name)
+    active = resolve_graph(db, name)
+    if active not in versions or versions.index(active) == 0:
+        raise ValueError(f"No version of {name} to roll back to")
+
+    previous = versions[versions.index(active) - 1]
+    db.connection.set(_pointer_key(name), previous)
+    print(f"{name} rolled back to {previous}")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["rollback"]:
+        rollback(FalkorDB(host='localhost', port=6379), "UFC")
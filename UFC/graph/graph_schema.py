@@ -1,66 +1,204 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+import ingest_state
+
+# number of introspection queries issued concurrently
+MAX_WORKERS = 4
+
+# string attributes with at most this many distinct values have them listed
+LOW_CARDINALITY = 20
+
+# schemas are cached on disk, one file per graph
+SCHEMA_CACHE_DIR = "../data/schema_cache"
+
+# bumped whenever the schema's layout changes, invalidates cached schemas
+SCHEMA_FORMAT = 2
+
+# labels and attributes starting with an underscore are ingest bookkeeping
+def _hidden(name):
+    return name.startswith('_')
+
+# Cypher typeOf names to the python type names the schema has always used
+TYPE_NAMES = {'Integer': 'int', 'Float': 'float', 'String': 'str', 'Boolean': 'bool',
+              'List': 'list', 'Array': 'list', 'Map': 'dict'}
+
+# count and attribute statistics of the entities matched by pattern, e.g. "(x:Fighter)"
+# attributes are discovered over every entity, not a sample, in two scans whatever the number of attributes
+def _entity_stats(g, pattern, indexed):
+    # every attribute and its type, an attribute holding values of several types takes the most common one
+    q = f"MATCH {pattern} UNWIND keys(x) AS key RETURN key, typeOf(x[key]), count(*)"
+    types = {}
+    for key, typ, n in g.ro_query(q).result_set:
+        if not _hidden(key) and n > types.get(key, ('', 0))[1]:
+            types[key] = (TYPE_NAMES.get(typ, typ.lower()), n)
+
+    attributes = {key: {'type': types[key][0], 'indexed': key in indexed} for key in sorted(types)}
+
+    # count, value range of every numeric attribute and values of low cardinality strings, e.g. Stance,
+    # in a single scan
+    numeric = [key for key in attributes if attributes[key]['type'] in ('int', 'float')]
+    strings = [key for key in attributes if attributes[key]['type'] == 'str']
+    q = f"MATCH {pattern} RETURN " + ", ".join(
+        ["count(x)"] +
+        [f"min(x.`{key}`), max(x.`{key}`)" for key in numeric] +
+        [f"count(DISTINCT x.`{key}`), collect(DISTINCT x.`{key}`)[0..{LOW_CARDINALITY}]" for key in strings])
+    row = g.ro_query(q).result_set[0]
+
+    count, row = row[0], row[1:]
+    for i, key in enumerate(numeric):
+        attributes[key]['min'] = row[2 * i]
+        attributes[key]['max'] = row[2 * i + 1]
+
+    row = row[2 * len(numeric):]
+    for i, key in enumerate(strings):
+        distinct, values = row[2 * i], row[2 * i + 1]
+        if distinct <= LOW_CARDINALITY:
+            attributes[key]['distinct'] = distinct
+            attributes[key]['values']   = sorted(values)
+
+    return {'count': count, 'attributes': attributes}
+
+# label or relationship type to indexed attributes map, per entity type
+def _indices(g):
+    indices = {'NODE': {}, 'RELATIONSHIP': {}}
+    q = "CALL db.indexes() YIELD label, properties, entitytype"
+    for lbl, properties, entitytype in g.ro_query(q).result_set:
+        indices.setdefault(entitytype, {}).setdefault(lbl, set()).update(properties)
+    return indices
+
+# (src, dest) label pairs connected by relationship type r, one query for all pairs
+def _edge_endpoints(g, r):
+    q = f"MATCH (a)-[:{r}]->(b) RETURN DISTINCT labels(a), labels(b)"
+    connects = set()
+    for src_lbls, dest_lbls in g.ro_query(q).result_set:
+        for src in src_lbls:
+            for dest in dest_lbls:
+                if not _hidden(src) and not _hidden(dest):
+                    connects.add((src, dest))
+    return sorted(connects)
+
 # collect graph's schema
 def graph_schema(g):
     schema = {}
 
-    #---------------------------------------------------------------------------
-    # process nodes
-    #---------------------------------------------------------------------------
+    q = "CALL db.labels()"
+    lbls = [x[0] for x in g.ro_query(q).result_set if not _hidden(x[0])]
 
-    nodes = {}
+    q = "CALL db.relationshiptypes()"
+    rels = [x[0] for x in g.ro_query(q).result_set]
 
-    q = "CALL db.labels()"
-    lbls = [x[0] for x in g.query(q).result_set]
-    
-    for l in lbls:
-        nodes[l] = {}
-        nodes[l]['attributes'] = {}
+    indices = _indices(g)
 
-        q = f"MATCH (n:{l}) RETURN n LIMIT 50"
-        result = g.query(q).result_set
+    # the remaining queries are independent of one another, run them concurrently
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        node_stats = {l: pool.submit(_entity_stats, g, f"(x:{l})", indices['NODE'].get(l, set()))
+                      for l in lbls}
+        edge_stats = {r: pool.submit(_entity_stats, g, f"()-[x:{r}]->()",
+                                     indices['RELATIONSHIP'].get(r, set()))
+                      for r in rels}
+        edge_endpoints = {r: pool.submit(_edge_endpoints, g, r) for r in rels}
 
-        for row in result:
-            node = row[0]
-            for attr in node.properties:
-                val = node.properties[attr]
-                if attr not in nodes[l]['attributes']:
-                    nodes[l]['attributes'][attr] = {'type': type(val).__name__}
+        #-----------------------------------------------------------------------
+        # process nodes
+        #-----------------------------------------------------------------------
 
+        nodes = {}
+        for l in lbls:
+            nodes[l] = node_stats[l].result()
 
-    schema['nodes'] = nodes
+        schema['nodes'] = nodes
 
-    #---------------------------------------------------------------------------
-    # process relations
-    #---------------------------------------------------------------------------
+        #-----------------------------------------------------------------------
+        # process relations
+        #-----------------------------------------------------------------------
+
+        edges = {}
+        for r in rels:
+            edges[r] = edge_stats[r].result()
+            edges[r]['connects'] = edge_endpoints[r].result()
+
+        schema['edges'] = edges
+
+    return schema
+
+# cheap summary of the graph's content, changes whenever a load changes the graph
+# the ingest version covers loads, counts cover graphs modified by other means
+def schema_fingerprint(g):
+    version = ingest_state.read_state(g).get('Version')
+    nodes   = g.ro_query("MATCH (n) RETURN count(n)").result_set[0][0]
+    edges   = g.ro_query("MATCH ()-[e]->() RETURN count(e)").result_set[0][0]
+    return [SCHEMA_FORMAT, version, nodes, edges]
+
+# graph's schema, reused from the on-disk cache while the graph's fingerprint is unchanged
+def cached_graph_schema(g, cache_dir=SCHEMA_CACHE_DIR):
+    path = os.path.join(cache_dir, f"{g.name}.json")
+    fingerprint = schema_fingerprint(g)
+
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+        if cached['fingerprint'] == fingerprint:
+            return cached['schema']
+    except (OSError, ValueError, KeyError):
+        pass  # missing or unreadable cache, recompute
+
+    schema = graph_schema(g)
+
+    # write to a temporary file first, concurrent readers never see a partial cache
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({'fingerprint': fingerprint, 'schema': schema}, f)
+    os.replace(tmp, path)
 
-    edges = {}
-    
-    q = "CALL db.relationshiptypes()"
-    rels = [x[0] for x in g.query(q).result_set]
-    
-    for r in rels:
-        edges[r] = {}
-        edges[r]['attributes'] = {}
-
-        q = f"MATCH ()-[e:{r}]->() RETURN e LIMIT 50"
-        result = g.query(q).result_set
-
-        for row in result:
-            edge = row[0]
-            for attr in edge.properties:
-                val = edge.properties[attr]
-                if attr not in edges[r]['attributes']:
-                    edges[r]['attributes'][attr] = {'type': type(val).__name__}
-
-        edges[r]['connects'] = []
-
-        # collect edge endpoints
-        for src in lbls:
-            for dest in lbls:
-                q = f"MATCH (:{src})-[:{r}]->(:{dest}) RETURN 1 LIMIT 1"
-                res = g.query(q).result_set
-                if len(res) == 1:
-                    edges[r]['connects'].append((src, dest))
-        
-    schema['edges'] = edges
-        
     return schema
+
+# describe an attribute's type, range, allowed values and index
+def _attribute_prompt(attr, stats):
+    prompt = f"The {attr} attribute is of type {stats['type']}"
+    if 'min' in stats:
+        prompt += f", ranging from {stats['min']} to {stats['max']}"
+    if 'values' in stats:
+        prompt += f", with {stats['distinct']} distinct values: " + ", ".join(repr(v) for v in stats['values'])
+    if stats.get('indexed'):
+        prompt += ", it is indexed"
+    return prompt + "\n"
+
+# render the schema as a prompt for the LLM
+def schema_to_prompt(schema):
+    prompt = "The Knowledge graph contains nodes of the following types:\n"
+
+    for node in schema['nodes']:
+        lbl = node
+        node = schema['nodes'][node]
+        prompt += f"There are {node['count']} {lbl} nodes\n"
+        if len(node['attributes']) > 0:
+            prompt += f"The {lbl} node type has the following set of attributes:\n"
+            for attr in node['attributes']:
+                prompt += _attribute_prompt(attr, node['attributes'][attr])
+        else:
+            prompt += f"The {lbl} node type has no attributes:\n"
+
+    prompt += "In addition the Knowledge graph contains edge of the following types:\n"
+
+    for edge in schema['edges']:
+        rel = edge
+        edge = schema['edges'][edge]
+        prompt += f"There are {edge['count']} {rel} edges\n"
+        if len(edge['attributes']) > 0:
+            prompt += f"The {rel} edge type has the following set of attributes:\n"
+            for attr in edge['attributes']:
+                prompt += _attribute_prompt(attr, edge['attributes'][attr])
+        else:
+            prompt += f"The {rel} edge type has no attributes:\n"
+
+        prompt += f"The {rel} edge connects the following entities:\n"
+        for conn in edge['connects']:
+            src  = conn[0]
+            dest = conn[1]
+            prompt += f"{src} is connected via {rel} to {dest}, (:{src})-[:{rel}]->(:{dest})\n"
+
+    prompt += "Prefer filtering on indexed attributes, they are looked up without scanning every node.\n"
+
+    return prompt
@@ -1,65 +1,100 @@
+import sys
 from falkordb import FalkorDB
+import queries
+import ingest_state
+import graph_alias
 import ingest_fighters
 import ingest_fights
 from hamilton import driver
 from hamilton.execution import executors
 
-def main():
+def main(chunk_size: int = 500, max_workers: int = 5, incremental: bool = False, fought: bool = False):
     # Connect to FalkorDB
-    db = FalkorDB(host='localhost', port=6379)
-    g  = db.select_graph("UFC")
+    db   = FalkorDB(host='localhost', port=6379)
+    live = db.select_graph(graph_alias.resolve_graph(db, "UFC"))
 
-    # Clear previous graph
-    if "UFC" in db.list_graphs():
-        g.delete()
+    # Incremental loads update the live graph in place,
+    # full loads build a new graph version while readers keep using the live one
+    if incremental:
+        g = live
+    else:
+        g = db.select_graph(graph_alias.staging_graph("UFC"))
 
-    # ---- load fighters ----
+    # versions keep increasing across graph versions
+    base_version = ingest_state.graph_version(db, live)
 
-    # Note if you want to track the progress of the load you can use the Hamilton UI:
-    # from hamilton_sdk import adapters
-    # tracker = adapters.HamiltonTracker(
-    #    project_id=44,  # modify this as needed
-    #    username="elijah@dagworks.io",
-    #    dag_name="load_fighters",
-    #    tags={"environment": "DEV", "team": "MY_TEAM", "version": "X"}
-    # )
-    # build the hamilton Driver
-    fighter_loader = (
-        driver.Builder()
-        .with_modules(ingest_fighters)
-        .enable_dynamic_execution(allow_experimental_mode=True)
-        .with_remote_executor(executors.MultiThreadingExecutor(5))
-        # .with_adapters(tracker)  # <-- uncomment this line if you want to track the progress
-        .build()
-    )
-    # display the functions in the module
-    fighter_loader.display_all_functions("ingest_fighters.png")
-    fighter_results = fighter_loader.execute(["write_to_graph"], inputs={"graph": g})
+    # a full load failing midway deletes its staging graph
+    with graph_alias.discard_on_failure(db, g, discard=not incremental):
+        # index the attributes used by MERGE lookups
+        queries.create_indices(g)
 
-    # ---- load fights ----
+        # once a graph has FOUGHT edges every incremental load keeps them up to date
+        fought = fought or (incremental and queries.has_fought(g))
 
-    # if you have the Hamilton UI you can see progress:
-    # from hamilton_sdk import adapters
-    # tracker = adapters.HamiltonTracker(
-    #    project_id=44,  # modify this as needed
-    #    username="elijah@dagworks.io",
-    #    dag_name="load_fights",
-    #    tags={"environment": "DEV", "team": "MY_TEAM", "version": "X"}
-    # )
-    fights_loader = (
-        driver.Builder()
-        .with_modules(ingest_fights)
-        .enable_dynamic_execution(allow_experimental_mode=True)
-        .with_remote_executor(executors.MultiThreadingExecutor(5))  # this will do 5 concurrent inserts
-        # .with_adapters(tracker)  # <-- uncomment this line if you want to track the progress
-        .build()
-    )
-    # display the functions in the module
-    fights_loader.display_all_functions("ingest_fights.png")
-    fight_results = fights_loader.execute(["collect_writes"], inputs={"graph": g})
+        # ---- load fighters ----
 
-    print(f"All done - loaded {fighter_results['write_to_graph']} fighters and {fight_results['collect_writes']} fights.")
+        # Note if you want to track the progress of the load you can use the Hamilton UI:
+        # from hamilton_sdk import adapters
+        # tracker = adapters.HamiltonTracker(
+        #    project_id=44,  # modify this as needed
+        #    username="elijah@dagworks.io",
+        #    dag_name="load_fighters",
+        #    tags={"environment": "DEV", "team": "MY_TEAM", "version": "X"}
+        # )
+        # build the hamilton Driver
+        fighter_loader = (
+            driver.Builder()
+            .with_modules(ingest_fighters)
+            .enable_dynamic_execution(allow_experimental_mode=True)
+            .with_remote_executor(executors.MultiThreadingExecutor(5))
+            # .with_adapters(tracker)  # <-- uncomment this line if you want to track the progress
+            .build()
+        )
+        # display the functions in the module
+        fighter_loader.display_all_functions("ingest_fighters.png")
+        fighter_results = fighter_loader.execute(["write_to_graph"], inputs={"graph": g})
+
+        # ---- load fights ----
+
+        # if you have the Hamilton UI you can see progress:
+        # from hamilton_sdk import adapters
+        # tracker = adapters.HamiltonTracker(
+        #    project_id=44,  # modify this as needed
+        #    username="elijah@dagworks.io",
+        #    dag_name="load_fights",
+        #    tags={"environment": "DEV", "team": "MY_TEAM", "version": "X"}
+        # )
+        fights_loader = (
+            driver.Builder()
+            .with_modules(ingest_fights)
+            .enable_dynamic_execution(allow_experimental_mode=True)
+            .with_remote_executor(executors.MultiThreadingExecutor(max_workers))  # concurrent chunk inserts
+            # .with_adapters(tracker)  # <-- uncomment this line if you want to track the progress
+            .build()
+        )
+        # display the functions in the module
+        fights_loader.display_all_functions("ingest_fights.png")
+        # FOUGHT edges are optional, write_fought skips them unless fought
+        fight_results = fights_loader.execute(["collect_writes", "write_aggregates", "write_fought",
+                                               "ingest_version", "fight_rows", "resolved_fights"],
+                                              inputs={"graph": g,
+                                                      "fighter_ids": fighter_results["write_to_graph"],
+                                                      "chunk_size": chunk_size,
+                                                      "incremental": incremental,
+                                                      "fought": fought,
+                                                      "base_version": base_version})
+
+        # switch readers over once the new version checks out
+        if not incremental:
+            graph_alias.validate(g, graph_alias.expected_counts(len(fighter_results["write_to_graph"]),
+                                                                fight_results["fight_rows"],
+                                                                fight_results["resolved_fights"],
+                                                                fought))
+            graph_alias.promote(db, "UFC", g.name)
+
+    print(f"All done - loaded {len(fighter_results['write_to_graph'])} fighters and {fight_results['collect_writes']} fights, "
+          f"graph version {fight_results['ingest_version']}.")
 
 
 if __name__ == "__main__":
-    main()
+    main(incremental="--incremental" in sys.argv, fought="--fought" in sys.argv)
@@ -2,144 +2,205 @@
 Vanilla code to load UFC data into a FalkorDB.
 """
 import csv
+import sys
+import queries
+import ingest_state
+import graph_alias
+import aggregates
 from utils import *
 from falkordb import FalkorDB
 
-def load_fights(g):
-    print("Loading fights")
-
+# Number of fights sent to the database per UNWIND query
+BATCH_SIZE = 500
+
+# Parse a single row of the fights CSV into a dictionary
+def parse_fight(row):
+    # Columns: R_fighter, B_fighter, R_KD, B_KD, R_SIG_STR.,B_SIG_STR.,
+    #          R_SIG_STR_pct, B_SIG_STR_pct, R_TOTAL_STR., B_TOTAL_STR.,
+    #          R_TD, B_TD, R_TD_pct, B_TD_pct, R_SUB_ATT, B_SUB_ATT,
+    #          R_REV, B_REV, R_CTRL, B_CTRL, R_HEAD, B_HEAD, R_BODY,
+    #          B_BODY, R_LEG, B_LEG, R_DISTANCE, B_DISTANCE, R_CLINCH,
+    #          B_CLINCH, R_GROUND, B_GROUND, win_by, last_round,
+    #          last_round_time, Format, Referee, date, location,
+    #          Fight_type, Winner
+
+    R_fighter       = row[0]
+    B_fighter       = row[1]
+    R_KD            = int(row[2])
+    B_KD            = int(row[3])
+    R_SIG_STR       = percentage_from_ratio(row[4])
+    B_SIG_STR       = percentage_from_ratio(row[5])
+
+    R_SIG_STR_pct = row[6]
+    if '%' in R_SIG_STR_pct:
+        R_SIG_STR_pct = percentage_to_float(R_SIG_STR_pct)
+
+    B_SIG_STR_pct = row[7]
+    if '%' in B_SIG_STR_pct:
+        B_SIG_STR_pct = percentage_to_float(B_SIG_STR_pct)
+
+    R_TOTAL_STR     = percentage_from_ratio(row[8])
+    B_TOTAL_STR     = percentage_from_ratio(row[9])
+    R_TD            = percentage_from_ratio(row[10])
+    B_TD            = percentage_from_ratio(row[11])
+
+    R_TD_pct = row[12]
+    if '%' in R_TD_pct:
+        R_TD_pct = percentage_to_float(R_TD_pct)
+    else:
+        R_TD_pct = 0
+
+    B_TD_pct = row[13]
+    if '%' in B_TD_pct:
+        B_TD_pct = percentage_to_float(B_TD_pct)
+    else:
+        B_TD_pct = 0.0
+
+    R_SUB_ATT       = int(row[14])
+    B_SUB_ATT       = int(row[15])
+    R_REV           = int(row[16])
+    B_REV           = int(row[17])
+
+    R_CTRL = row[18]
+    if ':' in R_CTRL:
+        R_CTRL = time_to_seconds(R_CTRL)
+
+    B_CTRL = row[19]
+    if ':' in B_CTRL:
+        B_CTRL = time_to_seconds(B_CTRL)
+
+    R_HEAD          = percentage_from_ratio(row[20])
+    B_HEAD          = percentage_from_ratio(row[21])
+    R_BODY          = percentage_from_ratio(row[22])
+    B_BODY          = percentage_from_ratio(row[23])
+    R_LEG           = percentage_from_ratio(row[24])
+    B_LEG           = percentage_from_ratio(row[25])
+    R_DISTANCE      = percentage_from_ratio(row[26])
+    B_DISTANCE      = percentage_from_ratio(row[27])
+    R_CLINCH        = percentage_from_ratio(row[28])
+    B_CLINCH        = percentage_from_ratio(row[29])
+    R_GROUND        = percentage_from_ratio(row[30])
+    B_GROUND        = percentage_from_ratio(row[31])
+    win_by          = row[32]
+    last_round      = int(row[33])
+    last_round_time = time_to_seconds(row[34])
+    Format          = row[35]
+
+    # might be empty
+    referee         = row[36]
+
+    date            = date_to_timestamp(row[37])
+    location        = row[38]
+    Fight_type      = row[39]
+
+    # might be empty
+    Winner          = row[40]
+
+    # mark winner & loser
+    winner = Winner
+    loser = B_fighter if Winner == R_fighter else R_fighter
+
+    return {'R_fighter': R_fighter, 'B_fighter': B_fighter,
+            'referee': referee, 'date': date, 'location': location,
+            'winner': winner, 'loser': loser, 'win_by': win_by,
+            'fight': {'Last_round': last_round,
+                      'Last_round_time': last_round_time, 'Format': Format,
+                      'Fight_type': Fight_type}}
+
+# Read and parse all fights
+def read_fights():
     with open("../data/raw_total_fight_data.csv") as f:
         reader = csv.reader(f, delimiter=';')
 
         # Skip header row
         next(reader)
 
+        fights = []
+        occurrences = {}
         for row in reader:
-            #print(row)
-            # Columns: R_fighter, B_fighter, R_KD, B_KD, R_SIG_STR.,B_SIG_STR.,
-            #          R_SIG_STR_pct, B_SIG_STR_pct, R_TOTAL_STR., B_TOTAL_STR.,
-            #          R_TD, B_TD, R_TD_pct, B_TD_pct, R_SUB_ATT, B_SUB_ATT,
-            #          R_REV, B_REV, R_CTRL, B_CTRL, R_HEAD, B_HEAD, R_BODY,
-            #          B_BODY, R_LEG, B_LEG, R_DISTANCE, B_DISTANCE, R_CLINCH,
-            #          B_CLINCH, R_GROUND, B_GROUND, win_by, last_round,
-            #          last_round_time, Format, Referee, date, location,
-            #          Fight_type, Winner
-            
-            R_fighter       = row[0]
-            B_fighter       = row[1]
-            R_KD            = int(row[2])
-            B_KD            = int(row[3])
-            R_SIG_STR       = percentage_from_ratio(row[4])
-            B_SIG_STR       = percentage_from_ratio(row[5])
-            
-            R_SIG_STR_pct = row[6]
-            if '%' in R_SIG_STR_pct:
-                R_SIG_STR_pct = percentage_to_float(R_SIG_STR_pct)
-            
-            B_SIG_STR_pct = row[7]
-            if '%' in B_SIG_STR_pct:
-                B_SIG_STR_pct = percentage_to_float(B_SIG_STR_pct)
-
-            R_TOTAL_STR     = percentage_from_ratio(row[8])
-            B_TOTAL_STR     = percentage_from_ratio(row[9])
-            R_TD            = percentage_from_ratio(row[10])
-            B_TD            = percentage_from_ratio(row[11])
-
-            R_TD_pct = row[12]
-            if '%' in R_TD_pct:
-                R_TD_pct = percentage_to_float(R_TD_pct)
-            else:
-                R_TD_pct = 0
-
-            B_TD_pct = row[13]
-            if '%' in B_TD_pct:
-                B_TD_pct = percentage_to_float(B_TD_pct)
-            else:
-                B_TD_pct = 0.0
-
-            R_SUB_ATT       = int(row[14])
-            B_SUB_ATT       = int(row[15])
-            R_REV           = int(row[16])
-            B_REV           = int(row[17])
-
-            R_CTRL = row[18]
-            if ':' in R_CTRL:
-                R_CTRL = time_to_seconds(R_CTRL)
-
-            B_CTRL = row[19]
-            if ':' in B_CTRL:
-                B_CTRL = time_to_seconds(B_CTRL)
-
-            R_HEAD          = percentage_from_ratio(row[20])
-            B_HEAD          = percentage_from_ratio(row[21])
-            R_BODY          = percentage_from_ratio(row[22])
-            B_BODY          = percentage_from_ratio(row[23])
-            R_LEG           = percentage_from_ratio(row[24])
-            B_LEG           = percentage_from_ratio(row[25])
-            R_DISTANCE      = percentage_from_ratio(row[26])
-            B_DISTANCE      = percentage_from_ratio(row[27])
-            R_CLINCH        = percentage_from_ratio(row[28])
-            B_CLINCH        = percentage_from_ratio(row[29])
-            R_GROUND        = percentage_from_ratio(row[30])
-            B_GROUND        = percentage_from_ratio(row[31])
-            win_by          = row[32]
-            last_round      = int(row[33])
-            last_round_time = time_to_seconds(row[34])
-            Format          = row[35]
-
-            # might be empty
-            referee         = row[36]
-
-            date            = date_to_timestamp(row[37])
-            location        = row[38]
-            Fight_type      = row[39]
-            
-            # might be empty
-            Winner          = row[40]
-
-            # create referee
-            q = "MERGE (:Referee {Name: $name})"
-            g.query(q, {'name': referee})
-
-            # create card
-            q = "MERGE (c:Card {Date: $date, Location: $location})"
-            g.query(q, {'date': date, 'location': location})
-
-            # create fight
-            q = """MATCH (c:Card {Date: $date, Location: $location})
-                   MATCH (ref:Referee {Name: $referee})
-                   MATCH (r:Fighter {Name:$R_fighter})
-                   MATCH (b:Fighter {Name:$B_fighter})
-                   CREATE (f:Fight)-[:PART_OF]->(c)
-                   SET f = $fight
-                   CREATE (f)-[:RED]->(r)
-                   CREATE (f)-[:BLUE]->(b)
-                   CREATE (ref)-[:REFEREED]->(f)
-                   RETURN ID(f)
-                """
-            f_id = g.query(q, {'date': date, 'location': location,
-                'referee': referee, 'R_fighter': R_fighter,
-                'B_fighter': B_fighter, 'fight': {'Last_round': last_round,
-                    'Last_round_time': last_round_time, 'Format': Format,
-                    'Fight_type': Fight_type}
-                }).result_set[0][0]
-            
-            # mark winner & loser
-            winner = Winner
-            loser = B_fighter if Winner == R_fighter else R_fighter
-            q = """MATCH (f:Fight) WHERE ID(f) = $fight_id
-                   MATCH (l:Fighter {Name:$loser})
-                   MATCH (w:Fighter {Name:$winner})
-                   CREATE (w)-[:WON]->(f), (l)-[:LOST]->(f)
-                """
-            g.query(q, {'fight_id': f_id, 'loser': loser, 'winner': winner})
+            fight = parse_fight(row)
+
+            # bookkeeping used by incremental loads
+            natural_key = (row[0], row[1], row[37], row[38])
+            occurrence = occurrences.get(natural_key, 0)
+            occurrences[natural_key] = occurrence + 1
+            fight['fight']['_key'] = ingest_state.fight_key(*natural_key, occurrence)
+            fight['fight']['_hash'] = ingest_state.fight_hash(row)
+
+            fights.append(fight)
+
+        return fights
+
+# Load a single fight, four queries per fight
+def load_fight(g, fight):
+    # create referee
+    q = "MERGE (:Referee {Name: $name})"
+    g.query(q, {'name': fight['referee']})
+
+    # create card
+    q = "MERGE (c:Card {Date: $date, Location: $location})"
+    g.query(q, {'date': fight['date'], 'location': fight['location']})
+
+    # create fight
+    q = """MATCH (c:Card {Date: $date, Location: $location})
+           MATCH (ref:Referee {Name: $referee})
+           MATCH (r:Fighter {Name:$R_fighter})
+           MATCH (b:Fighter {Name:$B_fighter})
+           CREATE (f:Fight)-[:PART_OF]->(c)
+           SET f = $fight
+           CREATE (f)-[:RED]->(r)
+           CREATE (f)-[:BLUE]->(b)
+           CREATE (ref)-[:REFEREED]->(f)
+           RETURN ID(f)
+        """
+    f_id = g.query(q, {'date': fight['date'], 'location': fight['location'],
+        'referee': fight['referee'], 'R_fighter': fight['R_fighter'],
+        'B_fighter': fight['B_fighter'], 'fight': fight['fight']
+        }).result_set[0][0]
+
+    # mark winner & loser
+    q = """MATCH (f:Fight) WHERE ID(f) = $fight_id
+           MATCH (l:Fighter {Name:$loser})
+           MATCH (w:Fighter {Name:$winner})
+           CREATE (w)-[:WON]->(f), (l)-[:LOST]->(f)
+        """
+    g.query(q, {'fight_id': f_id, 'loser': fight['loser'],
+                'winner': fight['winner']})
+
+# Load fights, when incremental only new and changed fights are loaded
+# returns all parsed fights, the fights written and the fighter IDs of the stale fights removed
+def load_fights(g, fighter_ids, incremental=False, batch_size=BATCH_SIZE):
+    print("Loading fights")
 
-def load_fighters(g):
-    print("Loading fighters")
-    
-    # index fighter's name
-    g.create_node_range_index("Fighter", "Name")
+    fights = read_fights()
+    pending = fights
+    removed = []
+
+    if incremental:
+        existing = ingest_state.existing_fights(g)
+        pending, stale = ingest_state.plan_fights(fights, existing)
+        removed = ingest_state.delete_fights(g, stale)
+
+    # no batch size, load fights one by one
+    if not batch_size:
+        for fight in pending:
+            load_fight(g, fight)
+        return fights, pending, removed
+
+    # create referees and cards in one go
+    referee_ids, card_ids = queries.create_referees_and_cards(g, pending)
+
+    # attach internal IDs, reports fights with unknown fighters
+    pending = queries.resolve_fights(pending, fighter_ids, referee_ids, card_ids)
 
+    # load fights in batches
+    for i in range(0, len(pending), batch_size):
+        g.query(queries.CREATE_FIGHTS, {'fights': pending[i:i + batch_size]})
+
+    return fights, pending, removed
+
+# Read and parse all fighters
+def read_fighters():
     fighters = [] # list of fighters attributes
 
     with open("../data/raw_fighter_details.csv") as f:
@@ -213,24 +274,59 @@ def load_fighters(g):
             attrs['Sub_Avg'] = float(Sub_Avg)
 
             fighters.append(attrs)
-        
-        # Load all fighters in one go.
-        q = "UNWIND $fighters as fighter CREATE (f:Fighter) SET f = fighter"
-        g.query(q, {'fighters': fighters})
 
-def main():
+        return fighters
+
+def load_fighters(g):
+    print("Loading fighters")
+
+    fighters = read_fighters()
+
+    # Load all fighters in one go, existing fighters are updated in place.
+    return queries.merge_fighters(g, fighters)
+
+def main(incremental=False, fought=False):
     # Connect to FalkorDB
-    db = FalkorDB(host='localhost', port=6379)
-    g  = db.select_graph("UFC")
+    db   = FalkorDB(host='localhost', port=6379)
+    live = db.select_graph(graph_alias.resolve_graph(db, "UFC"))
+
+    # Incremental loads update the live graph in place,
+    # full loads build a new graph version while readers keep using the live one
+    if incremental:
+        g = live
+    else:
+        g = db.select_graph(graph_alias.staging_graph("UFC"))
+
+    # a full load failing midway deletes its staging graph
+    with graph_alias.discard_on_failure(db, g, discard=not incremental):
+        # index the attributes used by MERGE lookups
+        queries.create_indices(g)
+
+        # once a graph has FOUGHT edges every incremental load keeps them up to date
+        fought = fought or (incremental and queries.has_fought(g))
+
+        fighter_ids = load_fighters(g)
+        fights, loaded, removed = load_fights(g, fighter_ids, incremental)
+
+        # materialize career aggregates, computed over all fights
+        print("Computing fighter aggregates")
+        aggregates.write_aggregates(g, aggregates.fighter_aggregates(fighter_ids, fights))
+
+        # fighter to fighter projection of the fights, only the pairs just loaded or removed
+        if fought:
+            print("Refreshing FOUGHT edges")
+            queries.refresh_fought(g, loaded + removed)
 
-    # Clear previous graph
-    if "UFC" in db.list_graphs():
-        g.delete()
+        # versions keep increasing across graph versions
+        base_version = ingest_state.graph_version(db, live)
+        version = ingest_state.write_state(g, fights, base_version)
 
-    load_fighters(g)
-    load_fights(g)
+        # switch readers over once the new version checks out
+        if not incremental:
+            graph_alias.validate(g, graph_alias.expected_counts(len(fighter_ids), fights, loaded, fought))
+            graph_alias.promote(db, "UFC", g.name)
 
-    print("All done")
+    print(f"All done - graph version {version}")
 
 if __name__ == "__main__":
-    main()
+    main(incremental="--incremental" in sys.argv, fought="--fought" in sys.argv)
@@ -2,6 +2,7 @@ import pandas as pd
 from hamilton.htypes import Parallelizable, Collect
 import falkordb
 import utils
+import queries
 
 
 def raw_fighter_details() -> pd.DataFrame:
@@ -63,10 +64,8 @@ def record(fighter: pd.Series) -> dict:
     return attrs
 
 
-def write_to_graph(record: Collect[dict], graph: falkordb.Graph) -> int:
-    """Take all records and then push to the DB"""
+def write_to_graph(record: Collect[dict], graph: falkordb.Graph) -> dict[str, int]:
+    """Take all records and then push to the DB, returns a fighter name to node ID map"""
     records = list(record)
     # Load all fighters in one go.
-    q = "UNWIND $fighters as fighter CREATE (f:Fighter) SET f = fighter"
-    graph.query(q, {'fighters': records})
-    return len(records)
+    return queries.merge_fighters(graph, records)
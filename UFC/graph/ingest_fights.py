@@ -1,102 +1,199 @@
+import numpy as np
 import pandas as pd
 import utils
+import queries
+import ingest_state
+import aggregates
 from hamilton.htypes import Parallelizable, Collect
 import falkordb
 
 
+# "x of y" columns, converted to the landed ratio
+RATIO_COLUMNS = [
+    "R_SIG_STR", "B_SIG_STR", "R_TOTAL_STR", "B_TOTAL_STR", "R_TD", "B_TD",
+    "R_HEAD", "B_HEAD", "R_BODY", "B_BODY", "R_LEG", "B_LEG",
+    "R_DISTANCE", "B_DISTANCE", "R_CLINCH", "B_CLINCH", "R_GROUND", "B_GROUND",
+]
+
+# "x%" columns, converted to a float in [0, 1]
+PERCENTAGE_COLUMNS = ["R_SIG_STR_pct", "B_SIG_STR_pct", "R_TD_pct", "B_TD_pct"]
+
+# plain integer columns
+COUNT_COLUMNS = ["R_KD", "B_KD", "R_SUB_ATT", "B_SUB_ATT", "R_REV", "B_REV", "last_round"]
+
+# "m:ss" columns, converted to seconds
+TIME_COLUMNS = ["R_CTRL", "B_CTRL", "last_round_time"]
+
+
 def raw_total_fight_data() -> pd.DataFrame:
-    """Loads the raw fight data"""
-    _df = pd.read_csv('../data/raw_total_fight_data.csv', delimiter=";")
+    """Loads the raw fight data, every column is read as is"""
+    _df = pd.read_csv('../data/raw_total_fight_data.csv', delimiter=";",
+                      dtype=str, keep_default_na=False)
     return _df
 
 
 def transformed_data(raw_total_fight_data: pd.DataFrame) -> pd.DataFrame:
-    """Does some light transformation on the data and adds some columns"""
-    _df = raw_total_fight_data
-    _df.last_round = _df.last_round.astype(int)
-    _df.last_round_time = _df.last_round_time.apply(lambda x: utils.time_to_seconds(x))
-    _df.date = _df.date.apply(lambda x: utils.date_to_timestamp(x))
-    _df["Loser"] = _df.apply(
-        lambda x: x["B_fighter"] if x["Winner"] == x["R_fighter"] else x["R_fighter"], axis=1)
+    """Converts every column to a typed column and adds the Loser column"""
+    _df = raw_total_fight_data.rename(columns=lambda c: c.rstrip("."))
+    for col in RATIO_COLUMNS:
+        _df[col] = utils.percentage_from_ratio_array(_df[col])
+    for col in PERCENTAGE_COLUMNS:
+        _df[col] = utils.percentage_to_float_array(_df[col])
+    for col in COUNT_COLUMNS:
+        _df[col] = _df[col].astype(int)
+    for col in TIME_COLUMNS:
+        _df[col] = pd.array(utils.time_to_seconds_array(_df[col]), dtype="Int64")
+    _df["date"] = pd.array(utils.date_to_timestamp_array(_df["date"]), dtype="Int64")
+    _df["Loser"] = np.where(_df["Winner"] == _df["R_fighter"], _df["B_fighter"], _df["R_fighter"])
     return _df
 
 
+def _joined(columns: list[pd.Series]) -> pd.Series:
+    return columns[0].str.cat(columns[1:], sep=ingest_state.FIELD_SEPARATOR)
+
+
+def fight_keys(raw_total_fight_data: pd.DataFrame) -> pd.DataFrame:
+    """Bookkeeping used by incremental loads: each fight's _key and the _hash of its raw row.
+
+    Same digests as ingest.read_fights, the fields are joined column-wise and only the hashing is per row."""
+    _raw = raw_total_fight_data
+    _occurrence = _raw.groupby(ingest_state.KEY_COLUMNS).cumcount().astype(str)
+    _key_fields = _joined([_raw[col] for col in ingest_state.KEY_COLUMNS] + [_occurrence])
+    _row_fields = _joined([_raw[col] for col in _raw.columns])
+    return pd.DataFrame({"_key": [ingest_state.joined_digest(_f) for _f in _key_fields],
+                         "_hash": [ingest_state.joined_digest(_f) for _f in _row_fields]},
+                        index=_raw.index)
+
+
 def columns_of_interest() -> list[str]:
-    """Returns the columns that we're interested in processing"""
+    """Returns the columns loaded into the graph.
+
+    The per fighter stats are typed by transformed_data but not stored on the Fight nodes:
+    R_KD, B_KD, R_SIG_STR, B_SIG_STR, R_SIG_STR_pct, B_SIG_STR_pct, R_TOTAL_STR, B_TOTAL_STR,
+    R_TD, B_TD, R_TD_pct, B_TD_pct, R_SUB_ATT, B_SUB_ATT, R_REV, B_REV, R_CTRL, B_CTRL,
+    R_HEAD, B_HEAD, R_BODY, B_BODY, R_LEG, B_LEG, R_DISTANCE, B_DISTANCE, R_CLINCH,
+    B_CLINCH, R_GROUND, B_GROUND"""
     return [
-        "R_fighter", "B_fighter",
-        #    R_KD, B_KD, R_SIG_STR.,B_SIG_STR.,
-        # R_SIG_STR_pct, B_SIG_STR_pct, R_TOTAL_STR., B_TOTAL_STR.,
-        # R_TD, B_TD, R_TD_pct, B_TD_pct, R_SUB_ATT, B_SUB_ATT,
-        # R_REV, B_REV, R_CTRL, B_CTRL, R_HEAD, B_HEAD, R_BODY,
-        # B_BODY, R_LEG, B_LEG, R_DISTANCE, B_DISTANCE, R_CLINCH,
-        # B_CLINCH, R_GROUND, B_GROUND, win_by,
-        "last_round",
+        "R_fighter", "B_fighter", "win_by", "last_round",
         "last_round_time", "Format", "Referee", "date", "location",
-        "Fight_type", "Winner", "Loser"
+        "Fight_type", "Winner", "Loser", "_key", "_hash"
     ]
 
 
-def fight(transformed_data: pd.DataFrame,
-          columns_of_interest: list[str],
-          ) -> Parallelizable[pd.Series]:
-    """Enables us to process each fight. We pass in a client along with each row"""
-    for _idx, _row in transformed_data[columns_of_interest].iterrows():
-        yield _row
-
-
-def write_to_graph(fight: pd.Series, graph: falkordb.Graph) -> str:
-    _row, _graph = fight, graph
-    # create referee
-    q = "MERGE (:Referee {Name: $name})"
-    _graph.query(q, {'name': _row.Referee if isinstance(_row.Referee, str) else ""})
-
-    # create card
-    q = "MERGE (c:Card {Date: $date, Location: $location})"
-    _graph.query(q, {'date': _row.date, 'location': _row.location})
-
-    # create fight
-    q = """MATCH (c:Card {Date: $date, Location: $location})
-           MATCH (ref:Referee {Name: $referee})
-           MATCH (r:Fighter {Name:$R_fighter})
-           MATCH (b:Fighter {Name:$B_fighter})
-           CREATE (f:Fight)-[:PART_OF]->(c)
-           SET f = $fight
-           CREATE (f)-[:RED]->(r)
-           CREATE (f)-[:BLUE]->(b)
-           CREATE (ref)-[:REFEREED]->(f)
-           RETURN ID(f)
-        """
-    f_id = _graph.query(
-        q,
-        {'date': _row.date,
-         'location': _row.location,
-         'referee': _row.Referee if isinstance(_row.Referee, str) else "",
-         'R_fighter': _row.R_fighter,
-         'B_fighter': _row.B_fighter,
-         'fight': {'Last_round': _row.last_round,
-                   'Last_round_time': _row.last_round_time,
-                   'Format': _row.Format,
-                   'Fight_type': _row.Fight_type}
-         }
-    ).result_set[0][0]
-
-    # mark winner & loser
-    q = """MATCH (f:Fight) WHERE ID(f) = $fight_id
-           MATCH (l:Fighter {Name:$loser})
-           MATCH (w:Fighter {Name:$winner})
-           CREATE (w)-[:WON]->(f), (l)-[:LOST]->(f)
-        """
-    _graph.query(
-        q,
-        {'fight_id': f_id,
-         'loser': _row.Loser,
-         'winner': _row.Winner
-         if isinstance(_row.Winner, str) else ""
+def fight_rows(transformed_data: pd.DataFrame,
+               fight_keys: pd.DataFrame,
+               columns_of_interest: list[str],
+               ) -> list[dict]:
+    """Turns each fight into a row consumed by the batched UNWIND query"""
+    _df = transformed_data.join(fight_keys)[columns_of_interest]
+    _df = _df.astype(object).where(_df.notna(), None)
+    return [
+        {'R_fighter': _row["R_fighter"],
+         'B_fighter': _row["B_fighter"],
+         'referee': _row["Referee"] if isinstance(_row["Referee"], str) else "",
+         'date': _row["date"],
+         'location': _row["location"],
+         'winner': _row["Winner"] if isinstance(_row["Winner"], str) else "",
+         'loser': _row["Loser"],
+         'win_by': _row["win_by"],
+         'fight': {'Last_round': _row["last_round"],
+                   'Last_round_time': _row["last_round_time"],
+                   'Format': _row["Format"],
+                   'Fight_type': _row["Fight_type"],
+                   '_key': _row["_key"],
+                   '_hash': _row["_hash"]}
          }
-    )
-    return "success"
+        for _row in _df.to_dict("records")
+    ]
+
+
+def existing_fights(graph: falkordb.Graph, incremental: bool) -> dict[str, str]:
+    """Fight key to row hash of every fight already in the graph, empty unless loading incrementally"""
+    if not incremental:
+        return {}
+    return ingest_state.existing_fights(graph)
+
+
+def fight_plan(fight_rows: list[dict], existing_fights: dict[str, str]) -> tuple[list[dict], list[str]]:
+    """New fights and fights whose row changed, along with the keys of the stale versions to remove"""
+    if not existing_fights:
+        return fight_rows, []
+    return ingest_state.plan_fights(fight_rows, existing_fights)
+
+
+def removed_fights(fight_plan: tuple[list[dict], list[str]], graph: falkordb.Graph) -> list[dict]:
+    """Removes the stale versions of changed fights, returns the fighter IDs of every fight removed"""
+    return ingest_state.delete_fights(graph, fight_plan[1])
+
+
+def pending_fights(fight_plan: tuple[list[dict], list[str]], removed_fights: list[dict]) -> list[dict]:
+    """Fights to load, once their stale versions are removed"""
+    return fight_plan[0]
+
+
+def referees_and_cards(pending_fights: list[dict], graph: falkordb.Graph) -> tuple[dict, dict]:
+    """Creates every referee and card once, before fanning out, returns their node IDs.
+
+    Doing this serially keeps concurrent writers from racing on MERGE and creating duplicates."""
+    return queries.create_referees_and_cards(graph, pending_fights)
+
+
+def resolved_fights(pending_fights: list[dict],
+                    fighter_ids: dict[str, int],
+                    referees_and_cards: tuple[dict, dict],
+                    ) -> list[dict]:
+    """Attaches node IDs to every fight, fights with unknown fighters are reported and dropped"""
+    referee_ids, card_ids = referees_and_cards
+    return queries.resolve_fights(pending_fights, fighter_ids, referee_ids, card_ids)
+
+
+def fight_chunk(resolved_fights: list[dict], chunk_size: int) -> Parallelizable[list[dict]]:
+    """Enables us to process chunks of fights, each chunk is written with a single query"""
+    for _i in range(0, len(resolved_fights), chunk_size):
+        yield resolved_fights[_i:_i + chunk_size]
+
+
+def write_to_graph(fight_chunk: list[dict], graph: falkordb.Graph) -> int:
+    """Writes a chunk of fights along with their edges"""
+    graph.query(queries.CREATE_FIGHTS, {'fights': fight_chunk})
+    return len(fight_chunk)
+
+
+def collect_writes(write_to_graph: Collect[int]) -> int:
+    return sum(write_to_graph)
+
+
+
+
+def fighter_aggregates(fight_rows: list[dict], fighter_ids: dict[str, int]) -> list[dict]:
+    """Career aggregates of every fighter, computed in one pass over all fights"""
+    return aggregates.fighter_aggregates(fighter_ids, fight_rows)
+
+
+def write_aggregates(fighter_aggregates: list[dict], collect_writes: int, graph: falkordb.Graph) -> int:
+    """Stores the aggregates as Fighter attributes once every fight is written"""
+    return aggregates.write_aggregates(graph, fighter_aggregates)
+
+
+def write_fought(resolved_fights: list[dict],
+                 removed_fights: list[dict],
+                 collect_writes: int,
+                 fought: bool,
+                 graph: falkordb.Graph,
+                 ) -> int:
+    """Refreshes the FOUGHT edges between the fighters of the fights just written or removed, if fought"""
+    if not fought:
+        return 0
+    return queries.refresh_fought(graph, resolved_fights + removed_fights)
+
 
+def ingest_version(write_aggregates: int,
+                   write_fought: int,
+                   fight_rows: list[dict],
+                   base_version: int,
+                   graph: falkordb.Graph,
+                   ) -> int:
+    """Records the watermark once fights, aggregates and FOUGHT edges are written, returns the new graph version.
 
-def collect_writes(write_to_graph: Collect[str]) -> int:
-    return len(list(write_to_graph))
\ No newline at end of file
+    Written last: readers cache results per version, an early bump would let them cache stale aggregates."""
+    return ingest_state.write_state(graph, fight_rows, base_version)
@@ -0,0 +1,119 @@
+"""
+Ingest bookkeeping kept in the graph, enables incremental loads.
+
+Every Fight carries a _key, identifying the fight (card date, location,
+fighters and, for rematches on the same card, the occurrence), and a _hash
+of its CSV row. A single _Ingest node holds the
+watermark (latest card date) and a version bumped on every load.
+Labels and attributes starting with an underscore are hidden from the schema.
+"""
+import hashlib
+
+STATE_LABEL = "_Ingest"
+
+# Columns identifying a fight in the raw fights CSV
+KEY_COLUMNS = ["R_fighter", "B_fighter", "date", "location"]
+
+
+# separates the fields of a digest
+FIELD_SEPARATOR = "\x1f"
+
+
+# digest of fields already joined with FIELD_SEPARATOR
+def joined_digest(text):
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def _digest(fields):
+    return joined_digest(FIELD_SEPARATOR.join(fields))
+
+
+# natural key of a fight, computed from its raw fields
+# occurrence tells apart fights between the same fighters on the same card
+def fight_key(R_fighter, B_fighter, date, location, occurrence=0):
+    return _digest([R_fighter, B_fighter, date, location, str(occurrence)])
+
+
+# content hash of a raw CSV row
+def fight_hash(row):
+    return _digest(row)
+
+
+STATE_QUERY = f"MATCH (s:{STATE_LABEL}) RETURN s.Watermark, s.Version"
+
+
+# ingest state from the result of STATE_QUERY
+def parse_state(result):
+    if len(result) == 0:
+        return {}
+    watermark, version = result[0]
+    return {'Watermark': watermark, 'Version': version}
+
+
+# current ingest state, empty if the graph was never loaded
+def read_state(g):
+    return parse_state(g.ro_query(STATE_QUERY).result_set)
+
+
+# version of a graph, 0 if it does not exist or was never loaded
+def graph_version(db, g):
+    if g.name not in db.list_graphs():
+        return 0
+    return read_state(g).get('Version') or 0
+
+
+# record a completed load, returns the new version
+# a graph without state starts from base_version, e.g. the live graph's version
+def write_state(g, fights, base_version=0):
+    dates = [fight['date'] for fight in fights if fight['date'] is not None]
+    q = f"""MERGE (s:{STATE_LABEL})
+            SET s.Watermark = $watermark,
+                s.Version = coalesce(s.Version, $base_version) + 1,
+                s.Updated = timestamp()
+            RETURN s.Version"""
+    params = {'watermark': max(dates, default=None), 'base_version': base_version}
+    return g.query(q, params).result_set[0][0]
+
+
+# fight key to hash map of every fight in the graph
+# fights loaded before the bookkeeping existed have no key, planning against them would load every fight twice
+def existing_fights(g):
+    q = "MATCH (f:Fight) WHERE f._key IS NULL RETURN count(f)"
+    unkeyed = g.query(q).result_set[0][0]
+    if unkeyed > 0:
+        raise ValueError(f"{unkeyed} fights of graph {g.name} have no _key, they were loaded before incremental "
+                         "loads were supported, run a full load first")
+
+    q = "MATCH (f:Fight) RETURN f._key, f._hash"
+    return {key: h for key, h in g.query(q).result_set}
+
+
+# split fights into the ones to load and the keys of stale fights to delete
+# a fight is loaded if its key is unknown or its row changed since last load
+def plan_fights(fights, existing):
+    new     = []
+    changed = []
+    for fight in fights:
+        key = fight['fight']['_key']
+        if key not in existing:
+            new.append(fight)
+        elif existing[key] != fight['fight']['_hash']:
+            changed.append(fight)
+
+    print(f"Incremental load: {len(new)} new fights, {len(changed)} changed, "
+          f"{len(fights) - len(new) - len(changed)} unchanged")
+
+    return new + changed, [fight['fight']['_key'] for fight in changed]
+
+
+# remove fights, along with their edges
+# returns the fighters' internal IDs of every removed fight, their FOUGHT edges need a refresh
+def delete_fights(g, keys):
+    if len(keys) == 0:
+        return []
+    q = """UNWIND $keys AS key
+           MATCH (r:Fighter)<-[:RED]-(f:Fight {_key: key})-[:BLUE]->(b:Fighter)
+           WITH f, ID(r) AS R_id, ID(b) AS B_id
+           DETACH DELETE f
+           RETURN R_id, B_id"""
+    return [{'R_id': r_id, 'B_id': b_id} for r_id, b_id in g.query(q, {'keys': keys}).result_set]
@@ -0,0 +1,322 @@
+"""
+Fast path for common questions, answered without asking the model for Cypher.
+
+A question is matched against registered intents using a dictionary of
+fighter names and keyword rules. Questions narrowed any further (against
+someone, by some method, in some year, ...) are left to the model, as the
+intents cannot answer them. A matching intent runs its prewritten,
+parameterized query and either hands the rows to the model to phrase the
+final answer (one model call) or renders a template answer (no model call).
+Questions matching no intent take the regular route.
+"""
+import re
+import time
+
+# render answers from templates rather than have the model phrase them from the retrieved rows
+TEMPLATE_ANSWERS = False
+
+# last names shorter than this are too ambiguous to identify a fighter on their own
+MIN_LAST_NAME = 4
+
+# names listed at most by intents returning a list of fighters
+MAX_LISTED = 20
+
+# words narrowing a question beyond what an intent answers, e.g. fastest win *against* someone
+QUALIFIERS = re.compile(r"\b(against|versus|vs|by|than|in|on|at|since|before|after|during|between|from|"
+                        r"over|under|with|without|anyone|anybody|someone|other|opponents?|title|belt|"
+                        r"rounds?|submissions?|knockouts?|ko|tko|decisions?|methods?|years?|events?|"
+                        r"cards?|division|weight|\w+weight|first|last|latest|recent|second|third|\d+)\b",
+                        re.IGNORECASE)
+
+# harmless phrases, removed before looking for qualifiers
+NEUTRAL = re.compile(r"\b((in|of|at) (the )?ufc( history)?|in history|of all time)\b", re.IGNORECASE)
+
+
+def _normalize(text):
+    text = text.replace("’", "'")
+    text = re.sub(r"'s\b", "", text)
+    return re.sub(r"[^\w.\- ]+", " ", text)
+
+
+def _date(timestamp):
+    return time.strftime("%Y-%m-%d", time.localtime(timestamp)) if timestamp is not None else "an unknown date"
+
+
+def _duration(seconds):
+    return f"{seconds // 60}:{seconds % 60:02d} minutes" if seconds >= 60 else f"{seconds} seconds"
+
+
+# lookup tables of fighter names, by full name and by last name when unique
+def name_index(names):
+    full_names = {}
+    last_names = {}
+    for name in names:
+        words = _normalize(name).lower().split()
+        if not words:
+            continue
+        full_names[" ".join(words)] = name
+        if len(words[-1]) >= MIN_LAST_NAME:
+            last_names.setdefault(words[-1], set()).add(name)
+
+    unique = {last: owners.pop() for last, owners in last_names.items() if len(owners) == 1}
+    return {'full_names': full_names, 'last_names': unique}
+
+
+# fighter name index of the graph
+def fighter_names(graph):
+    return name_index([name for name, in graph.ro_query("MATCH (f:Fighter) RETURN f.Name").result_set])
+
+
+# fighters mentioned in question, in order of appearance, longest names first,
+# and the question's words not part of a name
+# a last name on its own only counts when capitalized, e.g. Masvidal
+def _scan(question, index):
+    words = _normalize(question).split()
+    full_names = index['full_names']
+    longest = max((len(name.split()) for name in full_names), default=0)
+    found = []
+    rest = []
+    i = 0
+    while i < len(words):
+        name = None
+        for n in range(min(longest, len(words) - i), 0, -1):
+            name = full_names.get(" ".join(words[i:i + n]).lower())
+            if name is not None:
+                break
+        if name is None and words[i][:1].isupper():
+            n, name = 1, index['last_names'].get(words[i].lower())
+
+        if name is None:
+            rest.append(words[i])
+            i += 1
+            continue
+        if name not in found:
+            found.append(name)
+        i += n
+    return found, " ".join(rest)
+
+
+def find_fighters(question, index):
+    return _scan(question, index)[0]
+
+
+#-------------------------------------------------------------------------------
+# intents
+#-------------------------------------------------------------------------------
+
+# templates return None when a value they need is missing, e.g. on a graph without aggregates
+
+def _fighter_record(rows, params):
+    if not rows or None in rows[0]:
+        return None
+    name, wins, losses, draws, pct = rows[0]
+    return (f"{name} has a record of {wins} wins, {losses} losses and {draws} draws, "
+            f"winning {pct:.0%} of their fights.")
+
+
+def _fighter_fastest_win(rows, params):
+    if not rows or rows[0][2] is None:
+        return None
+    name, seconds, wins = rows[0]
+    if wins == 0:
+        return f"{name} has no recorded win."
+    if seconds is None:
+        return None
+    return f"{name}'s fastest win took {_duration(seconds)}."
+
+
+def _fastest_win(rows, params):
+    if not rows or None in rows[0]:
+        return None
+    name, seconds = rows[0]
+    return f"The fastest win is held by {name}, winning in {_duration(seconds)}."
+
+
+def _most_wins(rows, params):
+    if not rows or None in rows[0]:
+        return None
+    name, wins = rows[0]
+    return f"{name} has the most wins, {wins}."
+
+
+def _head_to_head(rows, params):
+    a, b = params['a'], params['b']
+    if not rows or rows[0][0] is None:
+        return f"{a} and {b} never fought each other."
+    count, a_wins, b_wins, first, last = rows[0]
+    if a_wins is None or b_wins is None:
+        return None
+    if count == 1:
+        winner = a if a_wins else b if b_wins else "neither of them"
+        return f"{a} and {b} fought once, on {_date(first)}, {winner} won."
+    answer = (f"{a} and {b} fought {count} times, between {_date(first)} and {_date(last)}. "
+              f"{a} won {a_wins}, {b} won {b_wins}")
+    return answer + (", a trilogy." if count == 3 else ".")
+
+
+def _trilogies(rows, params):
+    if not rows:
+        return "No two fighters fought each other three or more times."
+    return "Fighters who met three or more times: " + "; ".join(
+        f"{a} and {b} ({count} fights)" for a, b, count in rows) + "."
+
+
+def _win_percentage(rows, params):
+    pct = params['pct']
+    if not rows:
+        return None
+    total, names = rows[0]
+    if total == 0:
+        return f"No fighter has a {pct:.0%} win percentage."
+    if total > len(names):
+        return (f"{total} fighters have a {pct:.0%} win percentage, the first {len(names)} by name: "
+                + ", ".join(names) + ".")
+    return f"Fighters with a {pct:.0%} win percentage: " + ", ".join(names) + "."
+
+
+# every intent: a keyword rule, the number of fighters it is about,
+# relationship types and Fighter attributes it requires, its query and the template rendering its answer
+INTENTS = [
+    {
+        'name': 'head_to_head',
+        'pattern': r"\b(fought|fight|fights|faced|face|against|versus|vs|head to head|rematch|trilogy|met)\b",
+        'fighters': 2,
+        'requires': 'FOUGHT',
+        'query': """MATCH (a:Fighter {Name: $a})-[e:FOUGHT]->(b:Fighter {Name: $b})
+                    MATCH (b)-[r:FOUGHT]->(a)
+                    RETURN e.Count, e.Wins, r.Wins, e.First_date, e.Last_date""",
+        'answer': _head_to_head,
+    },
+    {
+        'name': 'fighter_fastest_win',
+        'pattern': r"\b(fastest|quickest)\b",
+        'fighters': 1,
+        'attributes': ['Fastest_win', 'Wins'],
+        'query': "MATCH (f:Fighter {Name: $a}) RETURN f.Name, f.Fastest_win, f.Wins",
+        'answer': _fighter_fastest_win,
+    },
+    {
+        'name': 'fighter_record',
+        'pattern': r"\b(record|win percentage|win rate|how many (wins|fights|losses))\b",
+        'fighters': 1,
+        'attributes': ['Wins', 'Losses', 'Draws', 'Win_pct'],
+        'query': "MATCH (f:Fighter {Name: $a}) RETURN f.Name, f.Wins, f.Losses, f.Draws, f.Win_pct",
+        'answer': _fighter_record,
+    },
+    {
+        'name': 'fastest_win',
+        'pattern': r"\b(fastest|quickest) (win|victory|finish)\b",
+        'fighters': 0,
+        'attributes': ['Fastest_win'],
+        'query': """MATCH (f:Fighter) WHERE f.Fastest_win IS NOT NULL
+                    RETURN f.Name, f.Fastest_win ORDER BY f.Fastest_win LIMIT 1""",
+        'answer': _fastest_win,
+    },
+    {
+        'name': 'most_wins',
+        'pattern': r"\bmost (wins|victories)\b",
+        'fighters': 0,
+        'attributes': ['Wins'],
+        'query': "MATCH (f:Fighter) WHERE f.Wins IS NOT NULL RETURN f.Name, f.Wins ORDER BY f.Wins DESC LIMIT 1",
+        'answer': _most_wins,
+    },
+    {
+        'name': 'trilogies',
+        'pattern': r"\btrilog(y|ies)\b",
+        'fighters': 0,
+        'requires': 'FOUGHT',
+        'query': """MATCH (a:Fighter)-[e:FOUGHT]->(b:Fighter) WHERE e.Count >= 3 AND a.Name < b.Name
+                    RETURN a.Name, b.Name, e.Count ORDER BY e.Count DESC, a.Name""",
+        'answer': _trilogies,
+    },
+    {
+        'name': 'win_percentage',
+        'pattern': r"(?P<pct>\d+(\.\d+)?)\s*% win (percentage|rate)",
+        'fighters': 0,
+        'attributes': ['Fights', 'Win_pct'],
+        'query': f"""MATCH (f:Fighter) WHERE f.Fights > 0 AND abs(f.Win_pct - $pct) < 0.005
+                     WITH f.Name AS name ORDER BY name
+                     RETURN count(name), collect(name)[0..{MAX_LISTED}]""",
+        'answer': _win_percentage,
+    },
+]
+
+
+# intent and query parameters matching the question, None if no intent applies
+# the question may only hold fighter names, the intent's keywords and words not narrowing it down
+def match_intent(question, index, schema):
+    fighters = find_fighters(question, index)
+    for intent in INTENTS:
+        if intent.get('requires') and intent['requires'] not in schema['edges']:
+            continue
+        fighter_attributes = schema['nodes'].get('Fighter', {}).get('attributes', {})
+        if any(attr not in fighter_attributes for attr in intent.get('attributes', [])):
+            continue
+        if len(fighters) != intent['fighters']:
+            continue
+        m = re.search(intent['pattern'], question, re.IGNORECASE)
+        if m is None:
+            continue
+        _, rest = _scan(re.sub(intent['pattern'], " ", question, flags=re.IGNORECASE), index)
+        if QUALIFIERS.search(NEUTRAL.sub(" ", rest)):
+            continue
+
+        params = dict(zip(['a', 'b'], fighters))
+        if 'pct' in m.groupdict():
+            params['pct'] = float(m['pct']) / 100
+        return intent, params
+    return None
+
+
+# template answer or context for the model, from the rows of the intent's query
+# None for both when the rows can't be rendered, leaving the question to the model
+def _fast_path_result(intent, params, rows, template_answers):
+    try:
+        answer = intent['answer'](rows, params)
+    except (TypeError, ValueError, IndexError) as e:
+        print(f"Fast path {intent['name']} failed to render {rows}: {e}")
+        answer = None
+    if answer is None:
+        return None, None
+    if template_answers:
+        return answer, None
+    return None, (f"Context retrieved from the knowledge graph for the question ({intent['name']}, "
+                  f"{params}): {rows}\nSummary: {answer}\n")
+
+
+# answer the question on the fast path
+# returns (answer, context), answer is set when rendered from a template,
+# context holds the retrieved rows for the model to phrase the answer, both None without a match
+def fast_path(graph, question, index, schema, template_answers=TEMPLATE_ANSWERS):
+    match = match_intent(question, index, schema)
+    if match is None:
+        return None, None
+
+    intent, params = match
+    try:
+        rows = graph.ro_query(intent['query'], params).result_set
+    except Exception:
+        # leave the question to the model
+        return None, None
+    return _fast_path_result(intent, params, rows, template_answers)
+
+
+# same as fast_path, for FalkorDB's asyncio client
+async def fast_path_async(graph, question, index, schema, template_answers=TEMPLATE_ANSWERS):
+    match = match_intent(question, index, schema)
+    if match is None:
+        return None, None
+
+    intent, params = match
+    try:
+        rows = (await graph.ro_query(intent['query'], params)).result_set
+    except Exception:
+        # leave the question to the model
+        return None, None
+    return _fast_path_result(intent, params, rows, template_answers)
+
+
+# fighter name index of a graph, for FalkorDB's asyncio client
+async def fighter_names_async(graph):
+    result = await graph.ro_query("MATCH (f:Fighter) RETURN f.Name")
+    return name_index([name for name, in result.result_set])
@@ -0,0 +1,158 @@
+"""
+Cypher queries and helpers shared by the UFC graph loaders.
+"""
+from redis.exceptions import ResponseError
+
+# create or update fighters in one go, returns each fighter's internal ID
+MERGE_FIGHTERS = """UNWIND $fighters AS fighter
+                    MERGE (f:Fighter {Name: fighter.Name})
+                    SET f += fighter
+                    RETURN f.Name, ID(f)"""
+
+# create referees in one go, returns each referee's internal ID
+CREATE_REFEREES = """UNWIND $names AS name
+                     MERGE (r:Referee {Name: name})
+                     RETURN name, ID(r)"""
+
+# create cards in one go, returns each card's internal ID
+CREATE_CARDS = """UNWIND $cards AS card
+                  MERGE (c:Card {Date: card.date, Location: card.location})
+                  RETURN card.date, card.location, ID(c)"""
+
+# create a batch of fights along with their edges
+# all endpoints are looked up by internal ID
+# rows without a winner (draw, no contest) skip the WON/LOST edges
+CREATE_FIGHTS = """UNWIND $fights AS fight
+                   MATCH (c:Card) WHERE ID(c) = fight.card_id
+                   MATCH (ref:Referee) WHERE ID(ref) = fight.referee_id
+                   MATCH (r:Fighter) WHERE ID(r) = fight.R_id
+                   MATCH (b:Fighter) WHERE ID(b) = fight.B_id
+                   CREATE (f:Fight)-[:PART_OF]->(c)
+                   SET f = fight.fight
+                   CREATE (f)-[:RED]->(r)
+                   CREATE (f)-[:BLUE]->(b)
+                   CREATE (ref)-[:REFEREED]->(f)
+                   WITH f, fight
+                   WHERE fight.winner_id IS NOT NULL
+                   MATCH (w:Fighter) WHERE ID(w) = fight.winner_id
+                   MATCH (l:Fighter) WHERE ID(l) = fight.loser_id
+                   CREATE (w)-[:WON]->(f), (l)-[:LOST]->(f)
+                """
+
+# recompute the FOUGHT edges of a batch of fighter pairs from their fights
+# one edge per direction, Wins counts the fights won by the edge's source
+# safe to rerun, edges are merged and their attributes overwritten
+REFRESH_FOUGHT = """UNWIND $pairs AS pair
+                    MATCH (a:Fighter) WHERE ID(a) = pair.a
+                    MATCH (b:Fighter) WHERE ID(b) = pair.b
+                    MATCH (a)<-[:RED|BLUE]-(f:Fight)-[:RED|BLUE]->(b), (f)-[:PART_OF]->(c:Card)
+                    OPTIONAL MATCH (a)-[w:WON]->(f)
+                    WITH a, b, count(f) AS fights, count(w) AS wins,
+                         min(c.Date) AS first_date, max(c.Date) AS last_date
+                    MERGE (a)-[e:FOUGHT]->(b)
+                    SET e.Count = fights, e.Wins = wins,
+                        e.First_date = first_date, e.Last_date = last_date
+                 """
+
+# remove the FOUGHT edges of a batch of fighter pairs that no longer share a fight, e.g. once it was deleted
+DROP_FOUGHT = """UNWIND $pairs AS pair
+                 MATCH (a:Fighter)-[e:FOUGHT]->(b:Fighter)
+                 WHERE ID(a) = pair.a AND ID(b) = pair.b
+                   AND NOT (a)<-[:RED|BLUE]-(:Fight)-[:RED|BLUE]->(b)
+                 DELETE e
+              """
+
+
+def _create_index(g, label, *attributes):
+    try:
+        g.create_node_range_index(label, *attributes)
+    except ResponseError as e:
+        # already indexed by a previous load
+        if "already indexed" not in str(e):
+            raise
+
+
+# index the attributes used by the MERGE lookups
+def create_indices(g):
+    _create_index(g, "Fighter", "Name")
+    _create_index(g, "Card", "Date", "Location")
+    _create_index(g, "Referee", "Name")
+    _create_index(g, "Fight", "_key")
+
+
+# create or update fighters, returns a fighter name to internal ID map
+def merge_fighters(g, fighters):
+    result = g.query(MERGE_FIGHTERS, {'fighters': fighters}).result_set
+    return {name: f_id for name, f_id in result}
+
+
+# create all referees and cards referenced by fights
+# returns referee name and (date, location) to internal ID maps
+def create_referees_and_cards(g, fights):
+    referees = list({fight['referee'] for fight in fights})
+    result = g.query(CREATE_REFEREES, {'names': referees}).result_set
+    referee_ids = {name: r_id for name, r_id in result}
+
+    cards = list({(fight['date'], fight['location']) for fight in fights})
+    cards = [{'date': date, 'location': location} for date, location in cards]
+    result = g.query(CREATE_CARDS, {'cards': cards}).result_set
+    card_ids = {(date, location): c_id for date, location, c_id in result}
+
+    return referee_ids, card_ids
+
+
+# attach internal IDs to fights
+# fights referring to an unknown fighter are dropped and reported once
+def resolve_fights(fights, fighter_ids, referee_ids, card_ids):
+    resolved   = []
+    unresolved = {}  # fighter name -> number of fights dropped
+
+    for fight in fights:
+        names = [fight['R_fighter'], fight['B_fighter']]
+        if fight['winner'] != '':
+            names += [fight['winner'], fight['loser']]
+
+        missing = [name for name in names if name not in fighter_ids]
+        if missing:
+            for name in set(missing):
+                unresolved[name] = unresolved.get(name, 0) + 1
+            continue
+
+        fight = dict(fight)
+        fight['R_id']       = fighter_ids[fight['R_fighter']]
+        fight['B_id']       = fighter_ids[fight['B_fighter']]
+        fight['winner_id']  = fighter_ids.get(fight['winner'])
+        fight['loser_id']   = fighter_ids.get(fight['loser']) if fight['winner'] != '' else None
+        fight['referee_id'] = referee_ids[fight['referee']]
+        fight['card_id']    = card_ids[(fight['date'], fight['location'])]
+        resolved.append(fight)
+
+    if unresolved:
+        print(f"Skipped {len(fights) - len(resolved)} fights, unresolved fighters: "
+              + ", ".join(f"{name} ({count})" for name, count in sorted(unresolved.items())))
+
+    return resolved
+
+
+# ordered fighter ID pairs of fights, both directions of every pairing
+def fought_pairs(fights):
+    pairs = set()
+    for fight in fights:
+        pairs.add((fight['R_id'], fight['B_id']))
+        pairs.add((fight['B_id'], fight['R_id']))
+    return [{'a': a, 'b': b} for a, b in sorted(pairs)]
+
+
+# refresh the FOUGHT edges between the fighters of resolved or deleted fights
+# returns the number of edges refreshed
+def refresh_fought(g, fights, batch_size=500):
+    pairs = fought_pairs(fights)
+    for i in range(0, len(pairs), batch_size):
+        g.query(REFRESH_FOUGHT, {'pairs': pairs[i:i + batch_size]})
+        g.query(DROP_FOUGHT, {'pairs': pairs[i:i + batch_size]})
+    return len(pairs)
+
+
+# whether the graph has FOUGHT edges, which incremental loads then keep up to date
+def has_fought(g):
+    return "FOUGHT" in [x[0] for x in g.query("CALL db.relationshiptypes()").result_set]
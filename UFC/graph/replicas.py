@@ -0,0 +1,150 @@
+"""
+Read replica routing.
+
+Question answering only reads the graph, so its queries can be spread across
+read replicas of the primary FalkorDB, leaving the primary to ingest.
+ReplicatedGraph stands in for falkordb.Graph: ro_query and explain go to a
+replica, picked round-robin or by fewest queries in flight, writes go to the
+primary. A replica failing to answer is taken out of rotation and the query is
+retried on another one, falling back to the primary once none is left. A
+replica is put back in rotation after answering a PING again.
+
+Only the synchronous client is routed, async_burr_QA.py reads from the primary.
+"""
+import itertools
+import threading
+import time
+import redis
+from falkordb import FalkorDB, Graph
+
+# (host, port) of the primary's read replicas, e.g. [('localhost', 6380), ('localhost', 6381)]
+READ_REPLICAS = []
+
+# how a replica is picked, 'round_robin' or 'least_loaded' (fewest queries in flight)
+ROUTING = 'least_loaded'
+
+# a replica out of rotation is health checked again after this many seconds
+RETRY_INTERVAL = 5
+
+# failures of the replica rather than of the query, only these are retried elsewhere
+CONNECTION_ERRORS = (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError)
+
+
+class Replica:
+    """A read replica's graph handle and health"""
+
+    def __init__(self, db: FalkorDB, name):
+        self.db         = db
+        self.graph      = db.select_graph(name)
+        self.in_flight  = 0
+        self.queries    = 0
+        self.failures   = 0
+        self.down_until = None  # when the replica is health checked again, None while in rotation
+
+    def ping(self):
+        try:
+            return self.db.connection.ping()
+        except CONNECTION_ERRORS:
+            return False
+
+
+class ReplicatedGraph(Graph):
+    """Graph reading from read replicas and writing to the primary, safe to share between threads"""
+
+    def __init__(self, primary: FalkorDB, name, replicas, routing=ROUTING, retry_interval=RETRY_INTERVAL):
+        if routing not in ('round_robin', 'least_loaded'):
+            raise ValueError(f"Unknown routing {routing}, expected round_robin or least_loaded")
+        super().__init__(primary, name)
+        self.primary        = primary.select_graph(name)
+        self.replicas       = [Replica(db, name) for db in replicas]
+        self.routing        = routing
+        self.retry_interval = retry_interval
+        self.primary_reads  = 0
+        self._turn          = itertools.count()
+        self._lock          = threading.Lock()
+
+    # put replicas due for a health check back in rotation if they answer
+    def _recover(self):
+        now = time.monotonic()
+        with self._lock:
+            due = [r for r in self.replicas if r.down_until is not None and r.down_until <= now]
+            for r in due:
+                # keep concurrent readers from checking it as well
+                r.down_until = now + self.retry_interval
+        for r in due:
+            healthy = r.ping()
+            with self._lock:
+                if healthy:
+                    r.down_until = None
+                    r.failures   = 0
+
+    # replica to read from, skipping those already tried, None if no replica is left
+    def _pick(self, tried):
+        self._recover()
+        with self._lock:
+            candidates = [r for r in self.replicas if r.down_until is None and r not in tried]
+            if not candidates:
+                self.primary_reads += 1
+                return None
+            # rotating the starting point spreads ties between equally loaded replicas
+            turn = next(self._turn) % len(candidates)
+            candidates = candidates[turn:] + candidates[:turn]
+            replica = candidates[0] if self.routing == 'round_robin' else min(candidates, key=lambda r: r.in_flight)
+            replica.in_flight += 1
+            replica.queries   += 1
+            return replica
+
+    def _read(self, method, *args, **kwargs):
+        tried = []
+        while True:
+            replica = self._pick(tried)
+            if replica is None:
+                return getattr(self.primary, method)(*args, **kwargs)
+            try:
+                return getattr(replica.graph, method)(*args, **kwargs)
+            except CONNECTION_ERRORS as e:
+                print(f"Read replica {self.replicas.index(replica)} of {self.name} failed, "
+                      f"taking it out of rotation: {e}")
+                with self._lock:
+                    replica.failures  += 1
+                    replica.down_until = time.monotonic() + self.retry_interval
+                tried.append(replica)
+            finally:
+                with self._lock:
+                    replica.in_flight -= 1
+
+    def ro_query(self, q, params=None, timeout=None):
+        return self._read('ro_query', q, params, timeout=timeout)
+
+    def explain(self, query, params=None):
+        return self._read('explain', query, params)
+
+    # health check every replica now, e.g. from a periodic job
+    def check_health(self):
+        with self._lock:
+            for r in self.replicas:
+                if r.down_until is not None:
+                    r.down_until = time.monotonic()
+        self._recover()
+        return self.stats()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'primary_reads': self.primary_reads,
+                'replicas': [{'healthy': r.down_until is None, 'queries': r.queries,
+                              'in_flight': r.in_flight, 'failures': r.failures} for r in self.replicas],
+            }
+
+
+# FalkorDB clients of the read replicas, addresses default to READ_REPLICAS
+def replica_clients(addresses=None, **kwargs):
+    addresses = READ_REPLICAS if addresses is None else addresses
+    return [FalkorDB(host=host, port=port, **kwargs) for host, port in addresses]
+
+
+# graph handle to answer questions from, reading from replicas when there are any
+def read_graph(db: FalkorDB, name, replicas=()):
+    if not replicas:
+        return db.select_graph(name)
+    return ReplicatedGraph(db, name, replicas)
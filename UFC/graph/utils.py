@@ -1,11 +1,51 @@
+import re
 from datetime import datetime
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from dateutil.tz import tzlocal
+
+# Each converter comes in two forms:
+# a scalar form, memoized as the same few values repeat across rows,
+# and an array form taking a column and returning a NumPy array.
+# Both forms return None / NaN for "---", empty and malformed values.
+
+# Maximum number of distinct values memoized per scalar converter
+CACHE_SIZE = 4096
+
+DATE_FORMATS = ["%b %d, %Y", "%B %d, %Y"]
+
+HEIGHT_PATTERN     = r"^\s*(\d+)'\s*(\d+)\"\s*$"   # 5' 11"
+REACH_PATTERN      = r'^\s*(\d+)"?\s*$'            # 72"
+TIME_PATTERN       = r"^\s*(\d+):(\d+)\s*$"        # 1:58
+PERCENTAGE_PATTERN = r"^\s*(\d+)%\s*$"             # 39%
+RATIO_PATTERN      = r"^\s*(\d+) of (\d+)\s*$"     # 41 of 103
+
+def _match(pattern, value):
+    if not isinstance(value, str):
+        return None
+    return re.match(pattern, value)
+
+# Convert the distinct values of a column only, then map them back onto every row
+def _by_value(column, convert):
+    codes, uniques = pd.Series(column).factorize()
+    values = convert(pd.Series(uniques, dtype=str))
+    values = np.append(np.asarray(values, dtype=float), np.nan)
+    # missing values are coded -1, which picks the trailing NaN
+    return values[codes]
+
+def _extract(column, pattern):
+    return column.str.extract(pattern).astype(float)
 
 # convert hight in feet and inches to centimeters
+@lru_cache(maxsize=CACHE_SIZE)
 def height_to_cm(height):
     # Split the height string into feet and inches
-    feet, inches = height.split("'")
-    feet   = int(feet)
-    inches = int(inches.replace('"', ''))
+    m = _match(HEIGHT_PATTERN, height)
+    if m is None:
+        return None
+
+    feet, inches = int(m[1]), int(m[2])
 
     # Convert feet and inches to centimeters
     total_inches = feet * 12 + inches
@@ -13,45 +53,101 @@ def height_to_cm(height):
 
     return cm
 
+def height_to_cm_array(column):
+    def convert(heights):
+        parts = _extract(heights, HEIGHT_PATTERN)
+        return (parts[0] * 12 + parts[1]) * 2.54
+    return _by_value(column, convert)
+
 # Convert reach from inches to centimeters
+@lru_cache(maxsize=CACHE_SIZE)
 def reach_to_cm(reach):
+    m = _match(REACH_PATTERN, reach)
+    if m is None:
+        return None
+
     # Convert inches to centimeters
-    inches = int(reach.replace('"', ''))
+    inches = int(m[1])
     return inches * 2.54
 
+def reach_to_cm_array(column):
+    return _by_value(column, lambda reaches: _extract(reaches, REACH_PATTERN)[0] * 2.54)
+
 # Convert datetime to UNIX timestamp
+@lru_cache(maxsize=CACHE_SIZE)
 def date_to_timestamp(date_str):
     # Parse the date string into a datetime object
-    try:
-        date_obj = datetime.strptime(date_str, "%b %d, %Y")
-    except ValueError:
+    for fmt in DATE_FORMATS:
         try:
-            date_obj = datetime.strptime(date_str, "%B %d, %Y")
-        except ValueError:
-            return None
+            date_obj = datetime.strptime(date_str, fmt)
+            break
+        except (TypeError, ValueError):
+            continue
+    else:
+        return None
 
     # Convert the datetime object to a Unix timestamp
     timestamp = date_obj.timestamp()
 
     return int(timestamp)
 
+def date_to_timestamp_array(column):
+    def convert(dates):
+        parsed = pd.to_datetime(dates, format=DATE_FORMATS[0], errors="coerce")
+        for fmt in DATE_FORMATS[1:]:
+            parsed = parsed.fillna(pd.to_datetime(dates, format=fmt, errors="coerce"))
+        # local time, same as datetime.timestamp()
+        parsed = parsed.dt.tz_localize(tzlocal(), ambiguous="NaT", nonexistent="shift_forward")
+        return (parsed - pd.Timestamp(0, tz="UTC")) / pd.Timedelta(seconds=1)
+    return _by_value(column, convert)
+
 # Convert time in min:seconds format to number of seconds
+@lru_cache(maxsize=CACHE_SIZE)
 def time_to_seconds(time):
     # 1:58
-    minutes, seconds = map(int, time.split(':'))
+    m = _match(TIME_PATTERN, time)
+    if m is None:
+        return None
+
+    minutes, seconds = int(m[1]), int(m[2])
     return minutes * 60 + seconds
 
+def time_to_seconds_array(column):
+    def convert(times):
+        parts = _extract(times, TIME_PATTERN)
+        return parts[0] * 60 + parts[1]
+    return _by_value(column, convert)
+
 # Convert percentage to float
+@lru_cache(maxsize=CACHE_SIZE)
 def percentage_to_float(precentage):
-    p = int(precentage.replace('%', ''))
+    m = _match(PERCENTAGE_PATTERN, precentage)
+    if m is None:
+        return None
+
+    p = int(m[1])
     return float(p / 100.0)
 
+def percentage_to_float_array(column):
+    return _by_value(column, lambda percentages: _extract(percentages, PERCENTAGE_PATTERN)[0] / 100.0)
+
 # Convert ratio in the format x of y to float
+@lru_cache(maxsize=CACHE_SIZE)
 def percentage_from_ratio(ratio):
     # 41 of 103
-    count, total = map(int, ratio.split(" of "))
+    m = _match(RATIO_PATTERN, ratio)
+    if m is None:
+        return None
+
+    count, total = int(m[1]), int(m[2])
     if total == 0:
         return 0.0
 
     return float (count / total)
 
+def percentage_from_ratio_array(column):
+    def convert(ratios):
+        parts = _extract(ratios, RATIO_PATTERN)
+        count, total = parts[0], parts[1]
+        return (count / total).where(total != 0, 0.0).where(total.notna())
+    return _by_value(column, convert)
@@ -0,0 +1,291 @@
+"""
+HTTP service answering questions for many conversations from a single process.
+
+The database connections, the graph's schema prompt and the OpenAI client are
+created once at startup and shared, every conversation is a Burr application
+of its own keyed by its app_id. The same service runs either agent, the graph
+one (graph/burr_QA.py) or the vector one (vector/burr_QA.py).
+
+Run from this folder:
+    python serve.py graph     # or: python serve.py vector
+
+    curl -X POST localhost:8000/sessions
+    curl -X POST localhost:8000/sessions/<app_id>/questions \
+         -H 'Content-Type: application/json' -d '{"question": "Who has the most wins?"}'
+"""
+import argparse
+import contextvars
+import os
+import sys
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from typing import Callable, Iterator
+
+import openai
+from burr.core import Application
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+GRAPH_NAME = "UFC"
+INDEX_NAME = "ufc"
+
+# FalkorDB connections shared by every conversation, a query waits up to POOL_TIMEOUT seconds for a free one
+POOL_SIZE    = 16
+POOL_TIMEOUT = 10
+
+# conversations idle for longer are dropped, as is the least recently used one past MAX_SESSIONS
+SESSION_IDLE_TIMEOUT = 30 * 60  # seconds
+MAX_SESSIONS         = 1000
+
+# questions answered at the same time, others wait up to QUEUE_TIMEOUT seconds before being turned away
+MAX_CONCURRENT_REQUESTS = 32
+QUEUE_TIMEOUT           = 30
+
+
+class Question(BaseModel):
+    question: str
+
+
+class Session:
+    """A conversation, answering one question at a time"""
+
+    def __init__(self, app: Application):
+        self.app       = app
+        self.lock      = threading.Lock()
+        self.last_used = time.monotonic()
+
+
+class SessionStore:
+    """Conversations by app_id, dropped once idle for too long, safe to share between threads"""
+
+    def __init__(self, new_application, max_sessions=MAX_SESSIONS, idle_timeout=SESSION_IDLE_TIMEOUT):
+        self.new_application = new_application
+        self.max_sessions    = max_sessions
+        self.idle_timeout    = idle_timeout
+        self.evicted         = 0
+        self._sessions       = OrderedDict()  # app_id -> Session, least recently used first
+        self._lock           = threading.Lock()
+
+    # drop idle conversations, the oldest are first in line
+    # conversations answering a question are kept
+    def _evict(self):
+        now = time.monotonic()
+        for app_id, session in list(self._sessions.items()):
+            expired = now - session.last_used > self.idle_timeout
+            if not expired and len(self._sessions) <= self.max_sessions:
+                break
+            if session.lock.locked():
+                continue
+            del self._sessions[app_id]
+            self.evicted += 1
+
+    def create(self):
+        app_id = str(uuid.uuid4())
+        # built outside the lock, the loaded graph makes it cheap
+        session = Session(self.new_application(app_id))
+        with self._lock:
+            self._sessions[app_id] = session
+            self._evict()
+        return app_id
+
+    def get(self, app_id):
+        with self._lock:
+            self._evict()
+            session = self._sessions.get(app_id)
+            if session is not None:
+                session.last_used = time.monotonic()
+                self._sessions.move_to_end(app_id)
+            return session
+
+    def delete(self, app_id):
+        with self._lock:
+            return self._sessions.pop(app_id, None) is not None
+
+    def stats(self):
+        with self._lock:
+            return {'sessions': len(self._sessions), 'evicted': self.evicted}
+
+
+# run the conversation until it waits for the next question, returns the answer
+def answer(app: Application, question: str) -> str:
+    _, _, state = app.run(
+        halt_before=["human_converse"],
+        inputs={"user_question": question},
+    )
+    return state['chat_history'][-1]['content']
+
+
+# same as answer, yielding the answer as it is generated
+def stream_answer(app: Application, question: str) -> Iterator[str]:
+    action, streaming_container = app.stream_result(
+        halt_after=["AI_generate_response"],
+        halt_before=["human_converse"],
+        inputs={"user_question": question},
+    )
+    streamed = False
+    for item in streaming_container:
+        streamed = True
+        yield item["delta"]
+    _, state = streaming_container.get()
+    if not streamed:
+        # answered without streaming, e.g. on the fast path
+        yield state['chat_history'][-1]['content']
+
+
+# new_application builds a conversation's Burr application from its app_id
+def create_app(new_application: Callable[[str], Application],
+               max_concurrent_requests=MAX_CONCURRENT_REQUESTS,
+               queue_timeout=QUEUE_TIMEOUT) -> FastAPI:
+    sessions = SessionStore(new_application)
+    slots    = threading.BoundedSemaphore(max_concurrent_requests)
+    api      = FastAPI(title="UFC QA")
+
+    # the conversation and a request slot, released once the question is answered
+    def acquire(app_id):
+        session = sessions.get(app_id)
+        if session is None:
+            raise HTTPException(404, f"Unknown or expired session {app_id}")
+        if not session.lock.acquire(blocking=False):
+            raise HTTPException(409, f"Session {app_id} is already answering a question")
+        if not slots.acquire(timeout=queue_timeout):
+            session.lock.release()
+            raise HTTPException(503, "Too many questions in flight, retry later",
+                                headers={"Retry-After": str(queue_timeout)})
+        return session
+
+    def release(session):
+        slots.release()
+        session.last_used = time.monotonic()
+        session.lock.release()
+
+    # release for a single question, safe to call more than once
+    def releaser(session):
+        once = threading.Lock()
+
+        def release_once():
+            if once.acquire(blocking=False):
+                release(session)
+        return release_once
+
+    @api.post("/sessions", status_code=201)
+    def create_session():
+        return {"app_id": sessions.create()}
+
+    @api.delete("/sessions/{app_id}", status_code=204)
+    def delete_session(app_id: str):
+        if not sessions.delete(app_id):
+            raise HTTPException(404, f"Unknown or expired session {app_id}")
+
+    @api.post("/sessions/{app_id}/questions")
+    def ask(app_id: str, body: Question, stream: bool = False):
+        session = acquire(app_id)
+        if stream:
+            release_stream = releaser(session)
+
+            def tokens():
+                # Burr tracks the stream in a context variable, the response is iterated from worker
+                # threads each with a context of its own, so every step runs in the same context
+                context = contextvars.copy_context()
+                generator = stream_answer(session.app, body.question)
+                try:
+                    while True:
+                        try:
+                            yield context.run(next, generator)
+                        except StopIteration:
+                            return
+                finally:
+                    context.run(generator.close)
+                    release_stream()
+
+            chunks = tokens()
+            # a stream dropped before its first chunk, e.g. the client disconnected, never runs the finally above,
+            # the session and its slot are then released once the stream is garbage collected
+            weakref.finalize(chunks, release_stream)
+            return StreamingResponse(chunks, media_type="text/plain")
+
+        start = time.perf_counter()
+        try:
+            response = answer(session.app, body.question)
+        finally:
+            release(session)
+        return {"app_id": app_id, "answer": response, "elapsed_ms": (time.perf_counter() - start) * 1000}
+
+    @api.get("/stats")
+    def stats():
+        return sessions.stats()
+
+    return api
+
+
+#-------------------------------------------------------------------------------
+# agents
+#-------------------------------------------------------------------------------
+
+# both agents are a burr_QA.py module, imported from the agent's folder
+def _use_folder(name):
+    folder = os.path.join(HERE, name)
+    sys.path.insert(0, folder)
+    # the agents resolve their data paths from their own folder
+    os.chdir(folder)
+
+
+def graph_agent(openai_client: openai.OpenAI, host='localhost', port=6379) -> Callable[[str], Application]:
+    _use_folder("graph")
+    import redis
+    from falkordb import FalkorDB
+    from burr_QA import build_application, load_graph
+    from graph_alias import resolve_graph
+    from replicas import READ_REPLICAS
+
+    # a pool of connections per server, the primary and each of its read replicas
+    def connect(host, port):
+        pool = redis.BlockingConnectionPool(host=host, port=port, max_connections=POOL_SIZE,
+                                            timeout=POOL_TIMEOUT, decode_responses=True)
+        return FalkorDB(connection_pool=pool)
+
+    db_client = connect(host, port)
+    # questions are answered from the read replicas, if any are configured
+    replica_clients = [connect(*address) for address in READ_REPLICAS]
+    loaded = {'graph': load_graph(db_client, GRAPH_NAME, replica_clients)}
+    lock = threading.Lock()
+
+    # every session starts on the live version of the graph, full loads promote a new version and drop old ones,
+    # so the pointer is resolved again and the graph, its schema and fighter names reloaded once it moved
+    def new_application(app_id):
+        with lock:
+            if resolve_graph(db_client, GRAPH_NAME) != loaded['graph']['graph'].name:
+                loaded['graph'] = load_graph(db_client, GRAPH_NAME, replica_clients)
+                print(f"{GRAPH_NAME} now served from {loaded['graph']['graph'].name}")
+            loaded_graph = loaded['graph']
+        return build_application(db_client, GRAPH_NAME, app_id, openai_client, loaded_graph)
+
+    return new_application
+
+
+def vector_agent(openai_client: openai.OpenAI) -> Callable[[str], Application]:
+    _use_folder("vector")
+    import pinecone
+    from burr_QA import build_application
+
+    pinecone_client = pinecone.Pinecone(api_key=os.getenv("PINECONE_TOKEN"))
+    index = pinecone_client.Index(INDEX_NAME)
+    return lambda app_id: build_application(pinecone_client, INDEX_NAME, app_id, openai_client, index)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve the UFC QA agent over HTTP")
+    parser.add_argument("agent", choices=["graph", "vector"], help="agent answering the questions")
+    parser.add_argument("--port", type=int, default=8000, help="port to listen on")
+    args = parser.parse_args()
+
+    _client = openai.OpenAI()
+    _new_application = graph_agent(_client) if args.agent == "graph" else vector_agent(_client)
+    uvicorn.run(create_app(_new_application), host="0.0.0.0", port=args.port)
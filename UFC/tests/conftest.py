@@ -0,0 +1,37 @@
+"""
+Both agents are flat folders of modules importing one another by bare name,
+graph/ and vector/ even share module names (burr_QA, chat_history).
+The load_agent fixture imports an agent's module from its folder and takes it out of
+sys.modules again, so the graph and vector versions can be tested side by side.
+"""
+import importlib
+import os
+import sys
+
+import pytest
+
+UFC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules found in both agents' folders
+SHARED_NAMES = ("burr_QA", "chat_history")
+
+sys.path.insert(0, UFC)
+
+
+def _load_agent(folder, name):
+    path = os.path.join(UFC, folder)
+    saved = {n: sys.modules.pop(n) for n in SHARED_NAMES if n in sys.modules}
+    sys.path.insert(0, path)
+    try:
+        return importlib.import_module(name)
+    finally:
+        sys.path.remove(path)
+        for n in SHARED_NAMES:
+            sys.modules.pop(n, None)
+        sys.modules.update(saved)
+
+
+# load_agent("graph", "burr_QA") is the graph agent's burr_QA module
+@pytest.fixture(scope="session")
+def load_agent():
+    return _load_agent
@@ -0,0 +1,181 @@
+"""
+replicas.py's routing of reads, with fake FalkorDB servers that can be taken down.
+"""
+import pytest
+import redis
+
+
+class FakeServer:
+    """FalkorDB client whose graphs answer with the server's name, until it is taken down"""
+
+    def __init__(self, name):
+        self.name       = name
+        self.up         = True
+        self.queries    = []
+        self.connection = self
+
+    def select_graph(self, graph_name):
+        return FakeGraph(self)
+
+    def execute_command(self, *args):
+        raise AssertionError("writes are not expected")
+
+    def ping(self):
+        if not self.up:
+            raise redis.exceptions.ConnectionError(f"{self.name} is down")
+        return True
+
+
+class FakeGraph:
+    def __init__(self, server):
+        self.server = server
+
+    def ro_query(self, q, params=None, timeout=None):
+        if not self.server.up:
+            raise redis.exceptions.ConnectionError(f"{self.server.name} is down")
+        if q == "bad query":
+            raise redis.exceptions.ResponseError("syntax error")
+        self.server.queries.append(q)
+        return self.server.name
+
+    def explain(self, query, params=None):
+        return self.ro_query(query, params)
+
+
+@pytest.fixture
+def replicas(load_agent):
+    return load_agent("graph", "replicas")
+
+
+@pytest.fixture
+def primary():
+    return FakeServer("primary")
+
+
+@pytest.fixture
+def servers():
+    return [FakeServer(f"replica{i}") for i in range(3)]
+
+
+@pytest.fixture
+def clock(replicas, monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(replicas.time, "monotonic", lambda: now[0])
+    return now
+
+
+def _reads(g, n):
+    return [g.ro_query("MATCH (f:Fighter) RETURN count(f)") for _ in range(n)]
+
+
+def test_round_robin(replicas, primary, servers):
+    g = replicas.ReplicatedGraph(primary, "UFC", servers, routing='round_robin')
+
+    assert _reads(g, 6) == ["replica0", "replica1", "replica2"] * 2
+    assert primary.queries == []
+    assert [r['queries'] for r in g.stats()['replicas']] == [2, 2, 2]
+
+
+def test_least_loaded(replicas, primary, servers):
+    g = replicas.ReplicatedGraph(primary, "UFC", servers, routing='least_loaded')
+    # replica0 is busy answering other questions
+    g.replicas[0].in_flight = 3
+
+    answered = _reads(g, 4)
+
+    assert "replica0" not in answered
+    assert set(answered) == {"replica1", "replica2"}
+    assert g.stats()['replicas'][0]['in_flight'] == 3
+    # reads done are no longer in flight
+    assert [r['in_flight'] for r in g.stats()['replicas'][1:]] == [0, 0]
+
+
+def test_unknown_routing(replicas, primary, servers):
+    with pytest.raises(ValueError):
+        replicas.ReplicatedGraph(primary, "UFC", servers, routing='random')
+
+
+def test_failed_replica_is_skipped(replicas, primary, servers, clock):
+    g = replicas.ReplicatedGraph(primary, "UFC", servers, routing='round_robin')
+    servers[0].up = False
+
+    # the read is retried on another replica, the others share the reads from then on
+    assert sorted(_reads(g, 4)) == ["replica1", "replica1", "replica2", "replica2"]
+    stats = g.stats()
+    assert [r['healthy'] for r in stats['replicas']] == [False, True, True]
+    assert stats['replicas'][0]['failures'] == 1
+    assert stats['primary_reads'] == 0
+
+
+def test_fallback_to_primary(replicas, primary, servers, clock):
+    g = replicas.ReplicatedGraph(primary, "UFC", servers)
+    for server in servers:
+        server.up = False
+
+    assert _reads(g, 2) == ["primary", "primary"]
+    assert g.explain("MATCH (f:Fighter) RETURN f") == "primary"
+    stats = g.stats()
+    assert stats['primary_reads'] == 3
+    # replicas out of rotation are not tried again before their health check
+    assert [r['failures'] for r in stats['replicas']] == [1, 1, 1]
+    assert not any(r['healthy'] for r in stats['replicas'])
+
+
+def test_query_errors_are_not_retried(replicas, primary, servers):
+    g = replicas.ReplicatedGraph(primary, "UFC", servers)
+
+    with pytest.raises(redis.exceptions.ResponseError):
+        g.ro_query("bad query")
+
+    stats = g.stats()
+    assert all(r['healthy'] and r['in_flight'] == 0 for r in stats['replicas'])
+    assert stats['primary_reads'] == 0
+
+
+def test_recovery_after_retry_interval(replicas, primary, servers, clock):
+    g = replicas.ReplicatedGraph(primary, "UFC", servers[:1], retry_interval=5)
+    servers[0].up = False
+    assert _reads(g, 1) == ["primary"]
+
+    # back up, but not health checked before retry_interval
+    servers[0].up = True
+    clock[0] = 4
+    assert _reads(g, 1) == ["primary"]
+
+    # answers the PING, back in rotation
+    clock[0] = 5
+    assert _reads(g, 1) == ["replica0"]
+    assert g.stats()['replicas'][0] == {'healthy': True, 'queries': 2, 'in_flight': 0, 'failures': 0}
+
+
+def test_failed_ping_keeps_replica_out(replicas, primary, servers, clock):
+    g = replicas.ReplicatedGraph(primary, "UFC", servers[:1], retry_interval=5)
+    servers[0].up = False
+    _reads(g, 1)
+
+    clock[0] = 5
+    assert _reads(g, 1) == ["primary"]
+    # checked again retry_interval after the failed PING
+    servers[0].up = True
+    clock[0] = 9
+    assert _reads(g, 1) == ["primary"]
+    clock[0] = 10
+    assert _reads(g, 1) == ["replica0"]
+
+
+def test_check_health(replicas, primary, servers, clock):
+    g = replicas.ReplicatedGraph(primary, "UFC", servers, retry_interval=60)
+    servers[0].up = servers[1].up = False
+    _reads(g, 3)
+
+    servers[0].up = True
+    stats = g.check_health()
+
+    assert [r['healthy'] for r in stats['replicas']] == [True, False, True]
+
+
+def test_read_graph_without_replicas(replicas, primary):
+    g = replicas.read_graph(primary, "UFC")
+
+    assert not isinstance(g, replicas.ReplicatedGraph)
+    assert g.ro_query("MATCH (n) RETURN n") == "primary"
@@ -0,0 +1,176 @@
+"""
+serve.py's request handling, with conversations that answer once told to.
+"""
+import gc
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from burr.core import ApplicationBuilder, action, default
+from fastapi.testclient import TestClient
+
+import serve
+
+# how long a test waits on another thread before failing
+WAIT = 5
+
+
+class Gate:
+    """Holds conversations answering a question until opened"""
+
+    def __init__(self):
+        self.answering = threading.Semaphore(0)  # released by every conversation starting to answer
+        self.opened    = threading.Event()
+
+    def wait_answering(self):
+        assert self.answering.acquire(timeout=WAIT), "no conversation started answering"
+
+
+def new_application(gate):
+    @action(reads=["chat_history"], writes=["chat_history"])
+    def human_converse(state, user_question: str):
+        return {}, state.append(chat_history={"role": "user", "content": user_question})
+
+    @action(reads=["chat_history"], writes=["chat_history"])
+    def AI_generate_response(state):
+        gate.answering.release()
+        assert gate.opened.wait(WAIT)
+        answer = f"answer to {state['chat_history'][-1]['content']}"
+        return {}, state.append(chat_history={"role": "assistant", "content": answer})
+
+    def build(app_id):
+        return (
+            ApplicationBuilder()
+            .with_actions(human_converse, AI_generate_response)
+            .with_transitions(("human_converse", "AI_generate_response", default),
+                              ("AI_generate_response", "human_converse", default))
+            .with_identifiers(app_id=app_id)
+            .with_state(chat_history=[])
+            .with_entrypoint("human_converse")
+            .build()
+        )
+
+    return build
+
+
+@pytest.fixture
+def gate():
+    return Gate()
+
+
+@pytest.fixture
+def client(gate):
+    return TestClient(serve.create_app(new_application(gate), max_concurrent_requests=1, queue_timeout=0.05))
+
+
+def _ask(client, app_id, question="Who has the most wins?", **params):
+    return client.post(f"/sessions/{app_id}/questions", json={"question": question}, params=params)
+
+
+def test_answer(client, gate):
+    gate.opened.set()
+    app_id = client.post("/sessions").json()["app_id"]
+
+    response = _ask(client, app_id)
+
+    assert response.status_code == 200
+    assert response.json()["answer"] == "answer to Who has the most wins?"
+
+
+def test_stream_releases_session(client, gate):
+    gate.opened.set()
+    app_id = client.post("/sessions").json()["app_id"]
+
+    # answered without streaming, the whole answer comes at once
+    assert _ask(client, app_id, stream="true").text == "answer to Who has the most wins?"
+    # the session and its request slot are free again once the stream ends
+    assert _ask(client, app_id).status_code == 200
+
+
+def test_unknown_session(client):
+    assert _ask(client, "missing").status_code == 404
+
+    app_id = client.post("/sessions").json()["app_id"]
+    assert client.delete(f"/sessions/{app_id}").status_code == 204
+    assert _ask(client, app_id).status_code == 404
+
+
+def test_busy_session(gate):
+    client = TestClient(serve.create_app(new_application(gate), max_concurrent_requests=4))
+    app_id = client.post("/sessions").json()["app_id"]
+
+    with ThreadPoolExecutor(1) as pool:
+        first = pool.submit(_ask, client, app_id)
+        gate.wait_answering()
+
+        # a conversation answers one question at a time
+        response = _ask(client, app_id, "How many fights?")
+        assert response.status_code == 409
+
+        gate.opened.set()
+        assert first.result(WAIT).status_code == 200
+
+    assert _ask(client, app_id, "How many fights?").json()["answer"] == "answer to How many fights?"
+
+
+def test_all_slots_taken(client, gate):
+    busy, waiting = (client.post("/sessions").json()["app_id"] for _ in range(2))
+
+    with ThreadPoolExecutor(1) as pool:
+        first = pool.submit(_ask, client, busy)
+        gate.wait_answering()
+
+        # the only request slot is taken, the question is turned away after queue_timeout
+        response = _ask(client, waiting)
+        assert response.status_code == 503
+        assert "Retry-After" in response.headers
+
+        gate.opened.set()
+        assert first.result(WAIT).status_code == 200
+
+    # the turned away conversation was not left locked
+    assert _ask(client, waiting).status_code == 200
+
+
+def test_evict_least_recently_used():
+    store = serve.SessionStore(lambda app_id: app_id, max_sessions=2)
+    first, second = store.create(), store.create()
+    store.get(first)  # second is now the least recently used
+
+    third = store.create()
+
+    assert store.get(second) is None
+    assert all(store.get(app_id) is not None for app_id in (first, third))
+    assert store.stats() == {'sessions': 2, 'evicted': 1}
+
+
+def test_evict_idle(monkeypatch):
+    clock = [0]
+    monkeypatch.setattr(serve.time, "monotonic", lambda: clock[0])
+    store = serve.SessionStore(lambda app_id: app_id, idle_timeout=60)
+    idle, busy = store.create(), store.create()
+    # a conversation answering a question is kept however long it takes
+    store.get(busy).lock.acquire()
+
+    clock[0] = 61
+    active = store.create()
+
+    assert store.get(idle) is None
+    assert store.get(busy) is not None
+    assert store.get(active) is not None
+    assert store.stats() == {'sessions': 2, 'evicted': 1}
+
+
+def test_dropped_stream_releases_session(gate):
+    api = serve.create_app(new_application(gate), max_concurrent_requests=1, queue_timeout=0.05)
+    client = TestClient(api)
+    app_id = client.post("/sessions").json()["app_id"]
+    ask = next(route.endpoint for route in api.routes if getattr(route, "name", None) == "ask")
+
+    # the client goes away before the first chunk is sent, the stream is never started
+    response = ask(app_id, serve.Question(question="Who has the most wins?"), stream=True)
+    del response
+    gc.collect()
+
+    gate.opened.set()
+    assert _ask(client, app_id).status_code == 200
@@ -0,0 +1,105 @@
+"""
+AI_generate_response streamed from a fake OpenAI endpoint: the real client
+parses server-sent events served by an httpx mock transport.
+"""
+import asyncio
+import json
+
+import httpx
+import openai
+import pytest
+from burr.core import ApplicationBuilder, action, default
+
+CHUNKS = ["Jon ", "Jones ", "has ", "27 wins."]
+
+HISTORY = [
+    {"role": "system", "content": "Answer from the graph."},
+    {"role": "user", "content": "How many wins does Jon Jones have?"},
+]
+
+
+def _chunk(delta, finish_reason=None):
+    return {"id": "chatcmpl-1", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4-turbo-preview",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+
+# the chat completion stream: the role, the content in CHUNKS, the finish reason and a usage chunk without choices
+def _events():
+    chunks = ([_chunk({"role": "assistant", "content": ""})] +
+              [_chunk({"content": c}) for c in CHUNKS] +
+              [_chunk({}, "stop"),
+               {"id": "chatcmpl-1", "object": "chat.completion.chunk", "created": 0,
+                "model": "gpt-4-turbo-preview", "choices": [], "usage": None}])
+    return "".join(f"data: {json.dumps(c)}\n\n" for c in chunks) + "data: [DONE]\n\n"
+
+
+class FakeEndpoint:
+    """Chat completions endpoint streaming CHUNKS, keeps the requests it was sent"""
+
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, request: httpx.Request):
+        self.requests.append(json.loads(request.content))
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, text=_events())
+
+
+@action(reads=[], writes=[])
+def human_converse(state, user_question: str):
+    return {"question": user_question}, state
+
+
+def _application(generate_response, client):
+    return (
+        ApplicationBuilder()
+        .with_actions(human_converse, AI_generate_response=generate_response.bind(client=client))
+        .with_transitions(("human_converse", "AI_generate_response", default),
+                          ("AI_generate_response", "human_converse", default))
+        .with_state(chat_history=list(HISTORY))
+        .with_entrypoint("AI_generate_response")
+        .build()
+    )
+
+
+def _check(endpoint, deltas, result, state):
+    assert endpoint.requests[0]["stream"] is True
+    assert endpoint.requests[0]["messages"] == HISTORY
+    assert deltas == CHUNKS
+    assert result["ai_response"] == "".join(CHUNKS)
+    assert result["time_to_first_token_ms"] is not None
+    assert state["chat_history"][:-1] == HISTORY
+    assert state["chat_history"][-1] == {"role": "assistant", "content": "".join(CHUNKS)}
+
+
+@pytest.mark.parametrize("folder", ["graph", "vector"])
+def test_stream(load_agent, folder):
+    burr_QA = load_agent(folder, "burr_QA")
+    endpoint = FakeEndpoint()
+    client = openai.OpenAI(api_key="test", base_url="http://openai.test/v1",
+                           http_client=httpx.Client(transport=httpx.MockTransport(endpoint)))
+    app = _application(burr_QA.AI_generate_response, client)
+
+    action, container = app.stream_result(halt_after=["AI_generate_response"])
+    deltas = [item["delta"] for item in container]
+    result, state = container.get()
+
+    assert action.name == "AI_generate_response"
+    _check(endpoint, deltas, result, state)
+    # the state is only updated once the stream ends
+    assert app.state["chat_history"] == state["chat_history"]
+
+
+def test_async_stream(load_agent):
+    async_burr_QA = load_agent("graph", "async_burr_QA")
+    endpoint = FakeEndpoint()
+    client = openai.AsyncOpenAI(api_key="test", base_url="http://openai.test/v1",
+                                http_client=httpx.AsyncClient(transport=httpx.MockTransport(endpoint)))
+    app = _application(async_burr_QA.AI_generate_response, client)
+
+    async def stream():
+        _, container = await app.astream_result(halt_after=["AI_generate_response"])
+        deltas = [item["delta"] async for item in container]
+        result, state = await container.get()
+        return deltas, result, state
+
+    _check(endpoint, *asyncio.run(stream()))
@@ -3,8 +3,36 @@ Vanilla code to query a Pinecone index with OpenAI's GPT-4 model.
 """
 
 import os
+import time
 from openai import OpenAI
 from pinecone import Pinecone
+from chat_history import trim_history
+
+# stream the model's answer to the terminal as it is generated
+# returns the answer and the time to its first token in ms
+def stream_answer(client, messages):
+    start = time.perf_counter()
+    time_to_first_token_ms = None
+    stream = client.chat.completions.create(
+        model="gpt-4-turbo-preview",
+        messages=messages,
+        stream=True,
+    )
+
+    content = []
+    print()
+    for chunk in stream:
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            continue
+        if time_to_first_token_ms is None:
+            time_to_first_token_ms = (time.perf_counter() - start) * 1000
+        content.append(chunk.choices[0].delta.content)
+        print(content[-1], end="", flush=True)
+    print("\n")
+    if time_to_first_token_ms is not None:
+        print(f"First token after {time_to_first_token_ms:.0f} ms\n")
+
+    return "".join(content), time_to_first_token_ms
 
 def main():
     client = OpenAI()
@@ -38,18 +66,13 @@ def main():
 
         content = f"Please use this context: {context}\n To answer the following question: {question}."
         messages.append({"role": "user", "content": content})
+        # bound the history sent to the model
+        messages = trim_history(messages)
 
-        response = client.chat.completions.create(
-            model="gpt-4-turbo-preview",
-            messages=messages
-        )
+        answer, _ = stream_answer(client, messages)
 
-        response_message = response.choices[0].message
-        
         # extend conversation with assistant's reply
-        messages.append(response_message)
-
-        print(f"\n{response_message.content}\n")
+        messages.append({"role": "assistant", "content": answer})
 
 if __name__ == "__main__":
     main()
@@ -1,12 +1,14 @@
 import os
-from typing import Tuple
+from typing import Generator, Optional, Tuple
 
 import openai
 from burr.core import ApplicationBuilder, State, default, expr, Application
-from burr.core.action import action
+from burr.core.action import action, streaming_action
 from burr.tracking import LocalTrackingClient
+import time
 import uuid
 import pinecone
+from chat_history import trim_history
 
 
 # --- helper functions
@@ -21,13 +23,14 @@ def set_inital_chat_history() -> list[dict]:
 # --- actions
 
 @action(
-    reads=[],
+    reads=["chat_history"],
     writes=["question", "chat_history"],
 )
 def human_converse(state: State, user_question: str) -> Tuple[dict, State]:
-    """Human converse step -- make sure we get input, and store it as state."""
+    """Human converse step -- make sure we get input, and store it as state, bounding the chat history."""
     new_state = state.update(question=user_question)
-    new_state = new_state.append(chat_history={"role": "user", "content": user_question})
+    chat_history = trim_history(state["chat_history"] + [{"role": "user", "content": user_question}])
+    new_state = new_state.update(chat_history=chat_history)
     return {"question": user_question}, new_state
 
 
@@ -70,31 +73,47 @@ def query_vectordb(state: State, vector_db_index: pinecone.Index, top_k: int = 2
     return {"num_results": len(response['matches'])}, new_state
 
 
-@action(
+@streaming_action(
     reads=["chat_history"],
     writes=["chat_history"],
 )
-def AI_generate_response(state: State, client: openai.Client) -> tuple[dict, State]:
-    """AI step to generate the response."""
+def AI_generate_response(state: State, client: openai.Client) -> Generator[Tuple[dict, Optional[State]], None, None]:
+    """AI step to generate the response, streamed token by token as it is generated."""
     messages = state["chat_history"]
-    response = client.chat.completions.create(
+    start = time.perf_counter()
+    time_to_first_token_ms = None
+    stream = client.chat.completions.create(
         model="gpt-4-turbo-preview",
         messages=messages,
+        stream=True,
     )  # get a new response from the model where it can see the function response
-    response_message = response.choices[0].message
-    new_state = state.append(chat_history=response_message.to_dict())
-    return {"ai_response": response_message.content,
-            "usage": response.usage.to_dict()}, new_state
+    content = []
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            if time_to_first_token_ms is None:
+                time_to_first_token_ms = (time.perf_counter() - start) * 1000
+            content.append(delta)
+            yield {"delta": delta}, None  # partial result, the state is updated once the stream ends
+    response = "".join(content)
+    new_state = state.append(chat_history={"role": "assistant", "content": response})
+    yield {"ai_response": response,
+           "time_to_first_token_ms": time_to_first_token_ms,
+           "total_ms": (time.perf_counter() - start) * 1000}, new_state
 
 
 def build_application(
         db_client: pinecone.Pinecone,
         index_name: str,
         application_run_id: str,
-        openai_client: openai.OpenAI) -> Application:
-    """Builds the application."""
-    # get the index to query
-    index = db_client.Index(index_name)
+        openai_client: openai.OpenAI,
+        index: Optional[pinecone.Index] = None) -> Application:
+    """Builds the application, index is opened from db_client when not given."""
+    # get the index to query, an open index can be shared between conversations
+    if index is None:
+        index = db_client.Index(index_name)
     # set the initial chat history
     base_messages = set_inital_chat_history()
 
@@ -147,8 +166,18 @@ if __name__ == '__main__':
         question = input("What can I help you with?\n")
         if question == "exit":
             break
-        action, _, state = _app.run(
+        # stream the answer as it is generated, other answers are printed once ready
+        action, streaming_container = _app.stream_result(
+            halt_after=["AI_generate_response"],
             halt_before=["human_converse"],
             inputs={"user_question": question},
         )
-        print(f"AI: {state['chat_history'][-1]['content']}\n")
+        print("AI: ", end="", flush=True)
+        streamed = False
+        for item in streaming_container:
+            print(item["delta"], end="", flush=True)
+            streamed = True
+        _, state = streaming_container.get()
+        if not streamed:
+            print(state['chat_history'][-1]['content'], end="")
+        print("\n")